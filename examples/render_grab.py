@@ -17,16 +17,17 @@ sys.path.append('..')
 import numpy as np
 import torch
 import os, glob
-import smplx
 import argparse
 from tqdm import tqdm
 
 from tools.objectmodel import ObjectModel
+from tools.modelpool import ModelPool
+from tools.catalog import SequenceCatalog
 from tools.meshviewer import Mesh, MeshViewer, points2sphere, colors
 from tools.utils import parse_npz
 from tools.utils import params2torch
 from tools.utils import makepath
-from tools.utils import to_cpu
+from tools.utils import forward_in_chunks
 from tools.utils import euler
 from tools.cfg_parser import Config
 
@@ -36,7 +37,11 @@ device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 def render_sequences(cfg):
 
     grab_path = cfg.grab_path
-    all_seqs = glob.glob(grab_path + '/*/*eat*.npz')
+    if cfg.get('use_catalog', False):
+        with SequenceCatalog(grab_path) as catalog:
+            all_seqs = catalog.sequences(action='eat')
+    else:
+        all_seqs = glob.glob(grab_path + '/*/*eat*.npz')
 
     mv = MeshViewer(width=1600, height=1200,offscreen=True)
 
@@ -47,49 +52,57 @@ def render_sequences(cfg):
     camera_pose[:3, 3] = np.array([-.5, -1.4, 1.5])
     mv.update_camera_pose(camera_pose)
 
+    # the body and hand models are created once and shared across the sequences
+    model_pool = ModelPool(cfg.model_path)
+
     choice = np.random.choice(len(all_seqs), 10, replace=False)
     for i in tqdm(choice):
-        vis_sequence(cfg,all_seqs[i], mv)
+        vis_sequence(cfg,all_seqs[i], mv, model_pool)
     mv.close_viewer()
 
 
-def vis_sequence(cfg,sequence, mv):
+def vis_sequence(cfg,sequence, mv, model_pool=None):
+
+        if model_pool is None:
+            model_pool = ModelPool(cfg.model_path)
 
         seq_data = parse_npz(sequence)
         n_comps = seq_data['n_comps']
         gender = seq_data['gender']
 
         T = seq_data.n_frames
+        chunk_size = cfg.get('forward_chunk_size', 0)
 
         sbj_mesh = os.path.join(grab_path, '..', seq_data.body.vtemp)
         sbj_vtemp = np.array(Mesh(filename=sbj_mesh).vertices)
 
-        sbj_m = smplx.create(model_path=cfg.model_path,
-                             model_type='smplx',
-                             gender=gender,
-                             num_pca_comps=n_comps,
-                             v_template=sbj_vtemp,
-                             batch_size=T)
+        sbj_m = model_pool.get('smplx', sbj_mesh,
+                               gender=gender,
+                               n_comps=n_comps,
+                               v_template=sbj_vtemp)
 
         sbj_parms = params2torch(seq_data.body.params)
-        verts_sbj = to_cpu(sbj_m(**sbj_parms).vertices)
+        verts_sbj = forward_in_chunks(lambda p: model_pool.forward(sbj_m, p),
+                                      sbj_parms, chunk_size)['vertices']
 
 
         obj_mesh = os.path.join(grab_path, '..', seq_data.object.object_mesh)
         obj_mesh = Mesh(filename=obj_mesh)
         obj_vtemp = np.array(obj_mesh.vertices)
-        obj_m = ObjectModel(v_template=obj_vtemp,
-                            batch_size=T)
+        obj_m = ObjectModel(v_template=obj_vtemp)
         obj_parms = params2torch(seq_data.object.params)
-        verts_obj = to_cpu(obj_m(**obj_parms).vertices)
+        verts_obj = forward_in_chunks(lambda p: obj_m(**p),
+                                      obj_parms, chunk_size)['vertices']
 
         table_mesh = os.path.join(grab_path, '..', seq_data.table.table_mesh)
         table_mesh = Mesh(filename=table_mesh)
         table_vtemp = np.array(table_mesh.vertices)
-        table_m = ObjectModel(v_template=table_vtemp,
-                            batch_size=T)
+        table_m = ObjectModel(v_template=table_vtemp)
         table_parms = params2torch(seq_data.table.params)
-        verts_table = to_cpu(table_m(**table_parms).vertices)
+        # the table usually does not move, its mesh is then transformed once and kept in the viewer
+        verts_table, table_static = table_m.forward_track(table_parms, chunk_size)
+        mv.set_fixed_meshes([Mesh(vertices=verts_table, faces=table_mesh.faces, vc=colors['white'])]
+                            if table_static else [])
 
         seq_render_path = makepath(sequence.replace('.npz','').replace(cfg.grab_path, cfg.render_path))
 
@@ -102,9 +115,11 @@ def vis_sequence(cfg,sequence, mv):
             s_mesh.set_vertex_colors(vc=colors['red'], vertex_ids=seq_data['contact']['body'][frame] > 0)
 
             s_mesh_wf = Mesh(vertices=verts_sbj[frame], faces=sbj_m.faces, vc=colors['grey'], wireframe=True)
-            t_mesh = Mesh(vertices=verts_table[frame], faces=table_mesh.faces, vc=colors['white'])
+            meshes = [o_mesh, s_mesh, s_mesh_wf]
+            if not table_static:
+                meshes.append(Mesh(vertices=verts_table[frame], faces=table_mesh.faces, vc=colors['white']))
 
-            mv.set_static_meshes([o_mesh, s_mesh, s_mesh_wf, t_mesh])
+            mv.set_static_meshes(meshes)
             mv.save_snapshot(seq_render_path+'/%04d.png'%frame)
 
 
@@ -133,7 +148,9 @@ if __name__ == '__main__':
     cfg = {
         'grab_path': grab_path,
         'model_path': model_path,
-        'render_path':render_path
+        'render_path':render_path,
+        'forward_chunk_size': 256,
+        'use_catalog': False,
     }
 
     cfg = Config(**cfg)
@@ -24,10 +24,12 @@ import argparse
 from tqdm import tqdm
 
 from tools.objectmodel import ObjectModel
+from tools.modelpool import ModelPool
+from tools.catalog import SequenceCatalog
 from tools.meshviewer import Mesh, MeshViewer, points2sphere, colors
 from tools.utils import parse_npz
 from tools.utils import params2torch
-from tools.utils import to_cpu
+from tools.utils import forward_in_chunks
 from tools.utils import euler
 from tools.cfg_parser import Config
 
@@ -39,7 +41,11 @@ def visualize_sequences(cfg):
 
     grab_path = cfg.grab_path
 
-    all_seqs = glob.glob(grab_path + '/*/*eat*.npz')
+    if cfg.get('use_catalog', False):
+        with SequenceCatalog(grab_path) as catalog:
+            all_seqs = catalog.sequences(action='eat')
+    else:
+        all_seqs = glob.glob(grab_path + '/*/*eat*.npz')
 
     mv = MeshViewer(offscreen=False)
 
@@ -49,33 +55,40 @@ def visualize_sequences(cfg):
     camera_pose[:3, 3] = np.array([-.5, -4., 1.5])
     mv.update_camera_pose(camera_pose)
 
+    # the body and hand models are created once and shared across the sequences
+    model_pool = ModelPool(cfg.model_path)
+
     choice = np.random.choice(len(all_seqs), 10, replace=False)
     for i in tqdm(choice):
-        vis_sequence(cfg,all_seqs[i], mv)
+        vis_sequence(cfg,all_seqs[i], mv, model_pool)
     mv.close_viewer()
 
 
-def vis_sequence(cfg,sequence, mv):
+def vis_sequence(cfg,sequence, mv, model_pool=None):
+
+        if model_pool is None:
+            model_pool = ModelPool(cfg.model_path)
 
         seq_data = parse_npz(sequence)
         n_comps = seq_data['n_comps']
         gender = seq_data['gender']
 
         T = seq_data.n_frames
+        chunk_size = cfg.get('forward_chunk_size', 0)
 
         sbj_mesh = os.path.join(grab_path, '..', seq_data.body.vtemp)
         sbj_vtemp = np.array(Mesh(filename=sbj_mesh).vertices)
 
-        sbj_m = smplx.create(model_path=cfg.model_path,
-                             model_type='smplx',
-                             gender=gender,
-                             num_pca_comps=n_comps,
-                             v_template=sbj_vtemp,
-                             batch_size=T)
+        sbj_m = model_pool.get('smplx', sbj_mesh,
+                               gender=gender,
+                               n_comps=n_comps,
+                               v_template=sbj_vtemp)
 
         sbj_parms = params2torch(seq_data.body.params)
-        verts_sbj = to_cpu(sbj_m(**sbj_parms).vertices)
-        joints_sbj = to_cpu(sbj_m(**sbj_parms).joints) 
+        output_sbj = forward_in_chunks(lambda p: model_pool.forward(sbj_m, p), sbj_parms,
+                                       chunk_size, outputs=['vertices', 'joints'])
+        verts_sbj = output_sbj['vertices']
+        joints_sbj = output_sbj['joints']
         joint_names = smplx.joint_names.JOINT_NAMES
         smplx_vertex_ids = smplx.vertex_ids.vertex_ids['smplx']
         rhand_joints = joints_sbj[:, [joint_names.index(name) for name in tools.consts.RHAND_JOINT_NAMES], :]
@@ -83,37 +96,32 @@ def vis_sequence(cfg,sequence, mv):
         joints_rh = np.concatenate((rhand_joints,rhand_tips),axis=1)
 
         rh_mesh = os.path.join(grab_path, '..', seq_data.rhand.vtemp)
-        rh_vtemp = np.array(Mesh(filename=rh_mesh).vertices)
-
-        rh_m = smplx.create(model_path=cfg.model_path,
-                            model_type='mano',
-                            is_rhand = True,
-                            v_template = rh_vtemp,
-                            num_pca_comps=n_comps,
-                            flat_hand_mean=True,
-                            batch_size=T)
+        rh_m = model_pool.get('mano', rh_mesh,
+                              is_rhand=True,
+                              n_comps=n_comps)
 
         rh_parms = params2torch(seq_data.rhand.params)
-        rh_output = rh_m(**rh_parms)
-        verts_rh = to_cpu(rh_output.vertices)
-        #joints_rh = to_cpu(rh_output.joints)
+        verts_rh = forward_in_chunks(lambda p: model_pool.forward(rh_m, p),
+                                     rh_parms, chunk_size)['vertices']
 
 
         obj_mesh = os.path.join(grab_path, '..', seq_data.object.object_mesh)
         obj_mesh = Mesh(filename=obj_mesh)
         obj_vtemp = np.array(obj_mesh.vertices)
-        obj_m = ObjectModel(v_template=obj_vtemp,
-                            batch_size=T)
+        obj_m = ObjectModel(v_template=obj_vtemp)
         obj_parms = params2torch(seq_data.object.params)
-        verts_obj = to_cpu(obj_m(**obj_parms).vertices)
+        verts_obj = forward_in_chunks(lambda p: obj_m(**p),
+                                      obj_parms, chunk_size)['vertices']
 
         table_mesh = os.path.join(grab_path, '..', seq_data.table.table_mesh)
         table_mesh = Mesh(filename=table_mesh)
         table_vtemp = np.array(table_mesh.vertices)
-        table_m = ObjectModel(v_template=table_vtemp,
-                            batch_size=T)
+        table_m = ObjectModel(v_template=table_vtemp)
         table_parms = params2torch(seq_data.table.params)
-        verts_table = to_cpu(table_m(**table_parms).vertices)
+        # the table usually does not move, its mesh is then transformed once and kept in the viewer
+        verts_table, table_static = table_m.forward_track(table_parms, chunk_size)
+        mv.set_fixed_meshes([Mesh(vertices=verts_table, faces=table_mesh.faces, vc=colors['white'])]
+                            if table_static else [])
 
         skip_frame = 4
         for frame in range(0,T, skip_frame):
@@ -122,8 +130,9 @@ def vis_sequence(cfg,sequence, mv):
             o_mesh.set_vertex_colors(vc=colors['red'], vertex_ids=seq_data['contact']['object'][frame] > 0)
             out_meshes.append(o_mesh)
 
-            t_mesh = Mesh(vertices=verts_table[frame], faces=table_mesh.faces, vc=colors['white'])
-            out_meshes.append(t_mesh)
+            if not table_static:
+                t_mesh = Mesh(vertices=verts_table[frame], faces=table_mesh.faces, vc=colors['white'])
+                out_meshes.append(t_mesh)
             
             if cfg.rhand_only:
                 s_mesh = Mesh(vertices=verts_rh[frame], faces=rh_m.faces, vc=[.3,.3,.6], smooth=False, wireframe=True)
@@ -165,7 +174,9 @@ if __name__ == '__main__':
     cfg = {
         'grab_path': grab_path,
         'model_path': model_path,
-        'rhand_only': rhand_only
+        'rhand_only': rhand_only,
+        'forward_chunk_size': 256,
+        'use_catalog': False,
     }
 
     cfg = Config(**cfg)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+import sys
+sys.path.append('.')
+sys.path.append('..')
+import numpy as np
+import os, glob
+import argparse
+
+from tqdm import tqdm
+from tools.cfg_parser import Config
+from tools.catalog import SequenceCatalog
+from tools.contact import SparseContact
+from tools.utils import makepath, makelogger, worker_pool
+from tools.utils import parse_npz
+
+# the sequence entry used to group the heatmaps, 'all' integrates all the sequences together
+GROUP_KEYS = {'sbj': 'sbj_id', 'obj': 'obj_name', 'intent': 'motion_intent', 'all': None}
+
+
+def sequence_counts(sequence):
+    '''
+    the number of frames each body and object vertex is in contact in a sequence.
+    Only the contacts and the metadata of the sequence are read
+    '''
+    seq_data = parse_npz(sequence, lazy=True)
+    body_contact = SparseContact.from_dense(seq_data.contact.body)
+    object_contact = SparseContact.from_dense(seq_data.contact.object)
+    return {'sbj_id': str(seq_data.sbj_id),
+            'obj_name': str(seq_data.obj_name),
+            'motion_intent': str(seq_data.motion_intent),
+            'framerate': float(seq_data.framerate),
+            'n_frames': len(body_contact),
+            'body': body_contact.contact_counts(),
+            'object': object_contact.contact_counts()}
+
+
+class ContactHeatmaps(object):
+
+    def __init__(self, group_by='obj'):
+        ''' Streaming accumulator of the contact heatmaps of the sequences
+
+            For each group (subject, object, intent, or all the sequences) the number of frames
+            each body vertex is in contact, and the same for the vertices of each object, are summed
+            over the sequences, with the total number of frames. The contact durations in seconds
+            are accumulated with the framerate of each sequence.
+
+                Parameters
+                ----------
+                group_by: str
+                    'sbj', 'obj', 'intent' or 'all'
+            '''
+
+        assert group_by in GROUP_KEYS
+        self.group_by = group_by
+        self.groups = {}
+
+    def add(self, counts):
+        '''
+        add the contact counts of a sequence, as returned by sequence_counts
+        '''
+        key = GROUP_KEYS[self.group_by]
+        group = 'all' if key is None else counts[key]
+        if group not in self.groups:
+            self.groups[group] = {'n_frames': 0, 'seconds': 0.,
+                                  'body': np.zeros(len(counts['body']), dtype=np.int64),
+                                  'body_seconds': np.zeros(len(counts['body']), dtype=np.float64),
+                                  'objects': {}}
+        heatmap = self.groups[group]
+        heatmap['n_frames'] += counts['n_frames']
+        heatmap['seconds'] += counts['n_frames'] / counts['framerate']
+        heatmap['body'] += counts['body']
+        heatmap['body_seconds'] += counts['body'] / counts['framerate']
+
+        obj_name = counts['obj_name']
+        if obj_name not in heatmap['objects']:
+            heatmap['objects'][obj_name] = {'n_frames': 0,
+                                            'counts': np.zeros(len(counts['object']), dtype=np.int64),
+                                            'seconds': np.zeros(len(counts['object']), dtype=np.float64)}
+        obj_heatmap = heatmap['objects'][obj_name]
+        obj_heatmap['n_frames'] += counts['n_frames']
+        obj_heatmap['counts'] += counts['object']
+        obj_heatmap['seconds'] += counts['object'] / counts['framerate']
+
+    def to_arrays(self):
+        '''
+        the heatmaps as flat arrays, the object heatmaps (with a different number of vertices for each object)
+        are concatenated with their offsets
+        '''
+        if not self.groups:
+            raise ValueError('no sequence was added to the heatmaps')
+        groups = sorted(self.groups)
+        objects = [(g, obj_name) for g, group in enumerate(groups) for obj_name in sorted(self.groups[group]['objects'])]
+        obj_heatmaps = [self.groups[groups[g]]['objects'][obj_name] for g, obj_name in objects]
+        obj_sizes = [len(heatmap['counts']) for heatmap in obj_heatmaps]
+
+        return {'group_by': np.array(self.group_by),
+                'groups': np.array(groups, dtype=str),
+                'n_frames': np.array([self.groups[group]['n_frames'] for group in groups], dtype=np.int64),
+                'seconds': np.array([self.groups[group]['seconds'] for group in groups], dtype=np.float64),
+                'body_counts': np.stack([self.groups[group]['body'] for group in groups]).astype(np.uint32),
+                'body_seconds': np.stack([self.groups[group]['body_seconds'] for group in groups]).astype(np.float32),
+                'object_groups': np.array([g for g, _ in objects], dtype=np.int32),
+                'object_names': np.array([obj_name for _, obj_name in objects], dtype=str),
+                'object_frames': np.array([heatmap['n_frames'] for heatmap in obj_heatmaps], dtype=np.int64),
+                'object_offsets': np.cumsum([0] + obj_sizes).astype(np.int64),
+                'object_counts': np.concatenate([heatmap['counts'] for heatmap in obj_heatmaps]).astype(np.uint32),
+                'object_seconds': np.concatenate([heatmap['seconds'] for heatmap in obj_heatmaps]).astype(np.float32)}
+
+    def save(self, outfname):
+        np.savez_compressed(outfname, **self.to_arrays())
+
+
+def load_heatmaps(fname):
+    '''
+    read the heatmaps saved by contact_heatmaps
+    :return: dict with, for each group, its number of frames and the contact counts (frames in contact) and
+             durations (seconds) of the body vertices and of the vertices of each object, e.g.
+             heatmaps['s1']['objects']['mug']['counts']
+    '''
+    with np.load(fname) as arrays:
+        heatmaps = {}
+        for g, group in enumerate(arrays['groups']):
+            heatmaps[str(group)] = {'n_frames': int(arrays['n_frames'][g]),
+                                    'seconds': float(arrays['seconds'][g]),
+                                    'body': {'counts': arrays['body_counts'][g],
+                                             'seconds': arrays['body_seconds'][g]},
+                                    'objects': {}}
+        offsets = arrays['object_offsets']
+        for i, (g, obj_name) in enumerate(zip(arrays['object_groups'], arrays['object_names'])):
+            s = slice(offsets[i], offsets[i + 1])
+            heatmaps[str(arrays['groups'][g])]['objects'][str(obj_name)] = {
+                'n_frames': int(arrays['object_frames'][i]),
+                'counts': arrays['object_counts'][s],
+                'seconds': arrays['object_seconds'][s]}
+    return heatmaps
+
+
+def heatmap_colors(counts, n_frames=None, color=[1., 0., 0.], base_color=[1., 1., 1.]):
+    '''
+    the vertex colors of a heatmap, for Mesh.set_vertex_colors(vc=...)
+    :param counts: the contact counts (or durations) of the vertices
+    :param n_frames: the heatmap is counts / n_frames, by default it is normalized by its largest value
+    :return: np.array Vx4, from base_color (no contact) to color (the most contact)
+    '''
+    counts = np.asarray(counts, dtype=np.float64)
+    scale = n_frames if n_frames is not None else counts.max()
+    heat = counts / scale if scale else np.zeros_like(counts)
+    heat = np.clip(heat, 0., 1.)[:, None]
+    rgb = (1. - heat) * np.array(base_color) + heat * np.array(color)
+    return np.concatenate([rgb, np.ones_like(heat)], axis=1)
+
+
+def contact_heatmaps(cfg, logger=None):
+
+    grab_path = cfg.grab_path
+    out_path = cfg.out_path
+    makepath(out_path)
+
+    if logger is None:
+        logger = makelogger(log_dir=os.path.join(out_path, 'contact_heatmaps.log'), mode='a').info
+    logger('Starting to accumulate the contact heatmaps of GRAB!')
+
+    if cfg.get('use_catalog', False):
+        with SequenceCatalog(grab_path, cfg.get('catalog_path'), logger=logger) as catalog:
+            all_seqs = catalog.sequences(**cfg.get('catalog_filters', {}))
+    else:
+        all_seqs = glob.glob(grab_path + '/*/*.npz')
+    logger('Total sequences: %d' % len(all_seqs))
+    if not all_seqs:
+        raise ValueError('no GRAB sequence found in %s' % grab_path)
+
+    group_by = cfg.get('group_by', 'obj')
+    heatmaps = ContactHeatmaps(group_by)
+
+    num_workers = cfg.get('num_workers', 0)
+    if num_workers > 0:
+        logger('Processing sequences with %d workers.' % num_workers)
+
+    with worker_pool(num_workers) as pool:
+        if pool is not None:
+            # the counts are summed, so the sequences can be processed in any order
+            results = pool.imap_unordered(sequence_counts, all_seqs)
+        else:
+            results = map(sequence_counts, all_seqs)
+
+        for counts in tqdm(results, total=len(all_seqs)):
+            heatmaps.add(counts)
+
+    outfname = os.path.join(out_path, 'contact_heatmaps_%s.npz' % group_by)
+    heatmaps.save(outfname)
+    logger('Saved the heatmaps of %d groups to %s' % (len(heatmaps.groups), outfname))
+    return outfname
+
+
+if __name__ == '__main__':
+
+    msg = '''
+        This code will integrate the contact maps of the GRAB sequences over time into contact heatmaps,
+        for the body and for each object, grouped by subject, object or intent.
+
+        The heatmaps are saved in out_path/contact_heatmaps_<group_by>.npz, read them with load_heatmaps
+        and color a mesh with mesh.set_vertex_colors(vc=heatmap_colors(counts, n_frames))
+            '''
+
+    parser = argparse.ArgumentParser(description='GRAB-contact-heatmaps')
+
+    parser.add_argument('--grab-path', required=True, type=str,
+                        help='The path to the downloaded grab data')
+    parser.add_argument('--out-path', default=None, type=str,
+                        help='The path to the folder to save the heatmaps')
+    parser.add_argument('--group-by', default='obj', type=str, choices=list(GROUP_KEYS),
+                        help='The heatmaps of each subject, object, intent, or of all the sequences')
+    parser.add_argument('--num-workers', default=0, type=int,
+                        help='The number of processes used to read the sequences')
+
+    args = parser.parse_args()
+
+    grab_path = args.grab_path
+    out_path = args.out_path
+    if out_path is None:
+        out_path = grab_path
+
+    cfg = {
+
+        # 'sbj', 'obj', 'intent' or 'all'
+        'group_by': args.group_by,
+
+        # number of worker processes for the sequences, 0 processes them serially
+        'num_workers': args.num_workers,
+
+        # if True, lists the sequences from the sequence catalog instead of globbing
+        'use_catalog': False,
+
+        # the filters of SequenceCatalog.query with use_catalog, e.g. {'subject': ['s1', 's2'], 'intent': 'use'}
+        # 'catalog_filters': {},
+
+        #IO path
+        'grab_path': grab_path,
+        'out_path': out_path,
+    }
+
+    cfg = Config(**cfg)
+
+    log_dir = os.path.join(out_path, 'contact_heatmaps.log')
+    logger = makelogger(log_dir=log_dir, mode='a').info
+    logger(msg)
+
+    contact_heatmaps(cfg, logger)
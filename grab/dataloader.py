@@ -11,42 +11,140 @@
 # Any use of the computer program without a valid license is prohibited and liable to prosecution.
 # Contact: ps-license@tuebingen.mpg.de
 #
-
+import sys
+sys.path.append('.')
+sys.path.append('..')
 
 import os
 import glob
+import json
 import pathlib
 import numpy as np
 import torch
 from torch.utils import data
 
+from tools.modelpool import ModelPool
+from tools.objectmodel import ObjectBank
+from tools.quantize import decode
+from tools.contact import SparseContact
+
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 class LoadData(data.Dataset):
     def __init__(self,
                  dataset_dir,
                  ds_name='train',
-                 dtype=torch.float32):
+                 dtype=torch.float32,
+                 load_mode='pt',
+                 share_memory=False,
+                 decode_verts=None,
+                 model_path=None):
+        '''
+        :param load_mode: 'pt' loads the .pt files of the split in memory, 'memmap' opens the
+                          per-field .npy files listed in schema.json as memory-mapped arrays,
+                          so only the accessed frames are read from the disk
+        :param share_memory: if True, the tensors are moved to shared memory, so the DataLoader
+                             workers do not duplicate them. Only useful with num_workers > 0,
+                             the whole split is copied to /dev/shm
+        :param decode_verts: list of the data groups ('body', 'rhand', 'lhand', 'object') whose vertices
+                             are computed from the saved parameters in the collate function,
+                             so they do not need to be saved at preprocessing
+        :param model_path: the path to the folder containing the smplx and mano models, for decode_verts
+        '''
 
         super().__init__()
 
         self.ds_path = os.path.join(dataset_dir, ds_name)
-        datasets = glob.glob(self.ds_path+'/*.pt')
-        self.ds = self.load(datasets)
+        self.load_mode = load_mode
+        if load_mode == 'memmap':
+            self.ds = self.load_memmap(os.path.join(self.ds_path, 'schema.json'))
+        else:
+            datasets = glob.glob(self.ds_path+'/*.pt')
+            self.ds = self.load(datasets)
+        self.codecs = self.load_codecs(os.path.join(self.ds_path, 'codecs.json'))
+        self.contacts = self.load_contacts(os.path.join(self.ds_path, 'contact_csr.npz'))
 
-        frame_names = np.load(os.path.join(dataset_dir,ds_name, 'frame_names.npz'))['frame_names']
-        self.frame_names = [os.path.join(dataset_dir, fname) for fname in frame_names]
-        self.frame_sbjs = np.asarray([pathlib.PurePath(name).parts[-3] for name in self.frame_names])
-        self.frame_objs = np.asarray([pathlib.PurePath(name).parts[-2].split('_')[0] for name in self.frame_names])
+        self.dataset_dir = dataset_dir
+        if os.path.exists(os.path.join(self.ds_path, 'frame_index.npz')):
+            self.load_frame_index(os.path.join(self.ds_path, 'frame_index.npz'))
+        else:
+            self.parse_frame_names(os.path.join(self.ds_path, 'frame_names.npz'))
 
-        self.sbjs = np.unique(self.frame_sbjs)
         self.obj_info = np.load(os.path.join(dataset_dir, 'obj_info.npy'), allow_pickle=True).item()
         self.sbj_info = np.load(os.path.join(dataset_dir, 'sbj_info.npy'), allow_pickle=True).item()
+        # the vertices saved for the body and hands preprocessed with a vertex subset, e.g. {'body': ids}
+        self.vertex_ids = {}
+        if os.path.exists(os.path.join(dataset_dir, 'vertex_ids.npz')):
+            with np.load(os.path.join(dataset_dir, 'vertex_ids.npz')) as vertex_ids:
+                self.vertex_ids = {part: vertex_ids[part] for part in vertex_ids.files}
+
+        self.decoder = None
+        if decode_verts:
+            sbj_meta = np.load(os.path.join(dataset_dir, 'sbj_meta.npy'), allow_pickle=True).item()
+            self.decoder = VertexDecoder(self, model_path, decode_verts, sbj_meta)
+
+        if share_memory:
+            self.share_memory()
+
+    def load_frame_index(self, frame_index_path):
+        '''
+        load the integer arrays saved at preprocessing: the sequence of each frame (frame_seqs),
+        its index in the sequence (frame_ids), its subject (frame_sbjs), object (frame_objs)
+        and intent (frame_intents), with their names in seq_names, sbjs, objs and intents
+        '''
+        frame_index = np.load(frame_index_path)
+        for names in ['seq_names', 'sbjs', 'objs', 'intents']:
+            setattr(self, names, frame_index[names])
+        self.frame_seqs = torch.from_numpy(frame_index['frame_seqs'])
+        self.frame_ids = torch.from_numpy(frame_index['frame_ids'])
+        for name in ['frame_sbjs', 'frame_objs', 'frame_intents']:
+            setattr(self, name, torch.from_numpy(frame_index[name]).to(torch.long))
+
+    def parse_frame_names(self, frame_names_path):
+        '''
+        build the integer arrays of load_frame_index from the frame names,
+        for the data preprocessed without frame_index.npz (no intents)
+        '''
+        frame_names = np.load(frame_names_path)['frame_names']
+        # the frame names are <sequence path without extension>_<frame id>
+        parts = np.char.rpartition(frame_names.astype(str), '_').reshape(-1, 3)
+        self.seq_names, frame_seqs = np.unique(parts[:, 0], return_inverse=True)
+        frame_ids = parts[:, 2].astype(np.int32)
+
+        seq_sbjs = [pathlib.PurePath(name).parts[-2] for name in self.seq_names]
+        seq_objs = [pathlib.PurePath(name).name.split('_')[0] for name in self.seq_names]
+        self.sbjs, seq_sbjs = np.unique(np.asarray(seq_sbjs, dtype=str), return_inverse=True)
+        self.objs, seq_objs = np.unique(np.asarray(seq_objs, dtype=str), return_inverse=True)
 
-        for idx, name in enumerate(self.sbjs):
-            self.frame_sbjs[(self.frame_sbjs == name)] = idx
+        self.frame_seqs = torch.from_numpy(frame_seqs.astype(np.int32))
+        self.frame_ids = torch.from_numpy(frame_ids)
+        self.frame_sbjs = torch.from_numpy(seq_sbjs[frame_seqs]).to(torch.long)
+        self.frame_objs = torch.from_numpy(seq_objs[frame_seqs]).to(torch.long)
+        self.intents = np.zeros(0, dtype=str)
+        self.frame_intents = None
 
-        self.frame_sbjs=torch.from_numpy(self.frame_sbjs.astype(np.int8)).to(torch.long)
+    def frame_name(self, idx):
+        seq_name = os.path.join(self.dataset_dir, self.seq_names[self.frame_seqs[idx]])
+        return '%s_%d' % (seq_name, self.frame_ids[idx])
+
+    def share_memory(self, source=None):
+        '''
+        move the tensors to shared memory, so the DataLoader workers use a single copy of them.
+        The memory-mapped fields are already shared through the page cache and are left as they are
+        '''
+        if source is None:
+            if self.load_mode != 'memmap':
+                self.share_memory(self.ds)
+            for t in [self.frame_seqs, self.frame_ids, self.frame_sbjs, self.frame_objs, self.frame_intents]:
+                if t is not None:
+                    t.share_memory_()
+            return
+
+        for k, v in source.items():
+            if isinstance(v, dict):
+                self.share_memory(v)
+            else:
+                v.share_memory_()
 
     def load(self,datasets):
         loaded = {}
@@ -55,34 +153,247 @@ class LoadData(data.Dataset):
             loaded[k] = torch.load(d)
         return loaded
 
-    def load_idx(self,idx, source=None):
+    def load_memmap(self, schema_path):
+        with open(schema_path, 'r') as f:
+            schema = json.load(f)
+        loaded = {}
+        for data_name, fields in schema['fields'].items():
+            k = data_name.split('_')[0]
+            loaded[k] = {}
+            for field, info in fields.items():
+                # copy-on-write mapping, the tensors are writable views of the files without copying them
+                array = np.load(os.path.join(self.ds_path, info['file']), mmap_mode='c')
+                loaded[k][field] = torch.from_numpy(array)
+        return loaded
 
-        if source is None:
+    def load_codecs(self, codecs_path):
+        '''
+        the parameters of the quantized fields, which are decoded in load_idx
+        '''
+        if not os.path.exists(codecs_path):
+            return {}
+        with open(codecs_path, 'r') as f:
+            codecs = json.load(f)
+        return {data_name.split('_')[0]: fields for data_name, fields in codecs.items()}
+
+    def load_contacts(self, contacts_path):
+        '''
+        the contacts saved with contact_format='csr', which are unpacked in load_idx
+        '''
+        if not os.path.exists(contacts_path):
+            return {}
+        with np.load(contacts_path) as arrays:
+            return {k: SparseContact.from_arrays(arrays, k) for k in ['body', 'object']}
+
+    def load_idx(self,idx, source=None, codecs=None):
+
+        top = source is None
+        if top:
             source = self.ds
+            codecs = self.codecs
 
         out = {}
         for k, v in source.items():
             if isinstance(v,dict):
-                out[k] = self.load_idx(idx, v)
+                out[k] = self.load_idx(idx, v, codecs.get(k, {}))
             else:
                 out[k] = v[idx]
+                if k in codecs:
+                    out[k] = decode(out[k], codecs[k])
+
+        if top:
+            frames = idx.numpy() if torch.is_tensor(idx) else idx
+            for k, contacts in self.contacts.items():
+                out.setdefault(k, {})['contact'] = torch.from_numpy(contacts.unpack(frames))
 
         return out
 
     def __len__(self):
-        return len(self.frame_names)
+        return len(self.frame_seqs)
+
+    def get_batch(self, indices):
+        '''
+        fetch several frames at once, with a single indexing of each field. It is called by
+        __getitem__ with a list of indices, so a DataLoader uses it with a BatchSampler as its sampler
+        and batch_size=None, e.g. DataLoader(ds, sampler=BatchSampler(RandomSampler(ds), 256, False), batch_size=None)
+        :param indices: list, np.array or torch.tensor of frame indices
+        :return: the same dict as __getitem__, with the batch as the first dimension
+        '''
+        indices = torch.as_tensor(np.asarray(indices), dtype=torch.long)
+        data_out = self.load_idx(indices)
+        data_out['idx'] = indices.to(torch.int32)
+        return data_out
 
     def __getitem__(self, idx):
 
+        if not np.isscalar(idx) and not (torch.is_tensor(idx) and idx.dim() == 0):
+            return self.get_batch(idx)
+
         data_out = self.load_idx(idx)
         data_out['idx'] = torch.from_numpy(np.array(idx, dtype=np.int32))
         return data_out
 
+    def collate(self, batch):
+        '''
+        the collate function of the DataLoader, computes the vertices of the decode_verts groups.
+        It also accepts the batches of get_batch, for a DataLoader with batch_size=None
+        '''
+        if isinstance(batch, (list, tuple)):
+            batch = data.default_collate(batch)
+        if self.decoder is not None:
+            self.decoder(batch)
+        return batch
+
+
+class LoadWindows(LoadData):
+    def __init__(self,
+                 dataset_dir,
+                 ds_name='train',
+                 window_length=30,
+                 window_stride=1,
+                 **kwargs):
+        '''
+        temporal windows of consecutive frames, taken from the runs of consecutive frames
+        of each sequence (frame_runs.npz), so a window never crosses a sequence or a gap
+        between the selected frames. Each window is a single slice of the split data
+        :param window_length: the number of frames in each window
+        :param window_stride: the number of frames between the starts of two windows
+        :param kwargs: the arguments of LoadData
+        '''
+
+        share_memory = kwargs.pop('share_memory', False)
+        super().__init__(dataset_dir, ds_name, share_memory=share_memory, **kwargs)
+
+        self.window_length = window_length
+        self.window_stride = window_stride
+
+        runs = np.load(os.path.join(self.ds_path, 'frame_runs.npz'))
+        window_starts = [start + np.arange(0, length - window_length + 1, window_stride)
+                         for start, length in zip(runs['run_starts'], runs['run_lengths'])]
+        window_starts = np.concatenate(window_starts) if window_starts else np.zeros(0)
+        self.window_starts = torch.from_numpy(window_starts.astype(np.int64))
+
+        if share_memory:
+            self.window_starts.share_memory_()
+
+    def __len__(self):
+        return len(self.window_starts)
+
+    def get_batch(self, indices):
+        '''
+        fetch several windows at once
+        :return: the same dict as __getitem__, with the batch as the first dimension
+        '''
+        indices = torch.as_tensor(np.asarray(indices), dtype=torch.long)
+        frames = self.window_starts[indices][:, None] + torch.arange(self.window_length)
+        data_out = self.load_idx(frames)
+        data_out['idx'] = frames.to(torch.int32)
+        data_out['window_idx'] = indices.to(torch.int32)
+        return data_out
+
+    def __getitem__(self, idx):
+
+        if not np.isscalar(idx) and not (torch.is_tensor(idx) and idx.dim() == 0):
+            return self.get_batch(idx)
+
+        start = int(self.window_starts[idx])
+        data_out = self.load_idx(slice(start, start + self.window_length))
+        data_out['idx'] = torch.arange(start, start + self.window_length, dtype=torch.int32)
+        data_out['window_idx'] = torch.from_numpy(np.array(idx, dtype=np.int32))
+        return data_out
+
+
+class VertexDecoder(object):
+
+    def __init__(self, dataset, model_path, decode_verts, sbj_meta):
+        '''
+        computes the body, hand and object vertices of a batch from the saved parameters,
+        with the subject templates in sbj_info and sbj_meta and the object samples in obj_info
+        '''
+        self.dataset = dataset
+        self.decode_verts = list(decode_verts)
+        self.sbj_meta = sbj_meta
+        # the models are created in each DataLoader worker, on the first batch
+        self.model_pool = ModelPool(model_path)
+        self.obj_bank = None
+
+    def __call__(self, batch):
+
+        idx = batch['idx'].to(torch.long)
+        frame_sbjs = self.dataset.frame_sbjs[idx]
+        frame_objs = self.dataset.frame_objs[idx]
+
+        for data_name in self.decode_verts:
+            source = batch[data_name]
+            params = {k: v.to(torch.float32) for k, v in source.items() if k not in ['verts', 'contact']}
+            if data_name == 'object':
+                # the frames of all the objects are transformed at once
+                source['verts'] = self.object_verts(frame_objs, params)
+                continue
+
+            verts = None
+            for group in torch.unique(frame_sbjs):
+                mask = frame_sbjs == group
+                group_params = {k: v[mask] for k, v in params.items()}
+                group_verts = self.subject_verts(data_name, self.dataset.sbjs[group], group_params)
+                if verts is None:
+                    verts = group_verts.new_zeros(idx.shape + group_verts.shape[1:])
+                verts[mask] = group_verts
+            source['verts'] = verts
+
+        return batch
+
+    def subject_verts(self, data_name, sbj_id, params):
+        meta = self.sbj_meta[sbj_id]
+        if data_name == 'body':
+            model = self.model_pool.get('smplx', meta['body_vtemp'],
+                                        gender=meta['gender'],
+                                        n_comps=meta['n_comps'],
+                                        v_template=self.dataset.sbj_info[sbj_id])
+        else:
+            model = self.model_pool.get('mano', meta['%s_vtemp' % data_name],
+                                        is_rhand=data_name == 'rhand',
+                                        n_comps=meta['n_comps'],
+                                        v_template=meta['%s_verts' % data_name])
+        # only the vertices of the subset used at preprocessing
+        if data_name in self.dataset.vertex_ids:
+            return self.model_pool.sparse(model, self.dataset.vertex_ids[data_name])(params).vertices
+        return self.model_pool.forward(model, params).vertices
+
+    def object_verts(self, frame_objs, params):
+        '''
+        the object vertices of the frames, padded with zeros for the objects with fewer vertex samples
+        '''
+        if self.obj_bank is None:
+            # the bank follows the order of dataset.objs, so the object ids are the frame_objs
+            self.obj_bank = ObjectBank([self.dataset.obj_info[obj_name]['verts_sample'] for obj_name in self.dataset.objs])
+        with torch.no_grad():
+            verts = self.obj_bank(frame_objs.reshape(-1),
+                                  params['global_orient'].reshape(-1, 3),
+                                  params['transl'].reshape(-1, 3)).vertices
+        return verts.view(frame_objs.shape + verts.shape[1:])
+
 if __name__=='__main__':
 
     data_path = 'PATH_TO_PROCESSED_DATA/grab_processed'
     ds = LoadData(data_path, ds_name='val')
+    # for data saved with export_format='npy'
+    # ds = LoadData(data_path, ds_name='val', load_mode='memmap')
+    # for a DataLoader with num_workers > 0, a single copy of the split is shared by the workers
+    # ds = LoadData(data_path, ds_name='val', share_memory=True)
 
     bs = 256
     dataloader = data.DataLoader(ds, batch_size=bs, shuffle=True, num_workers=0, drop_last=True)
 
+    # or fetch each batch at once with get_batch, without fetching and collating the single frames (faster)
+    batch_sampler = data.BatchSampler(data.RandomSampler(ds), batch_size=bs, drop_last=True)
+    dataloader = data.DataLoader(ds, sampler=batch_sampler, batch_size=None, num_workers=0)
+
+    # for data saved without vertices, they can be computed for each batch
+    # ds = LoadData(data_path, ds_name='val', decode_verts=['body', 'rhand', 'lhand', 'object'],
+    #               model_path='PATH_TO_DOWNLOADED_MODELS_FROM_SMPLX_WEBSITE/')
+    # dataloader = data.DataLoader(ds, batch_size=bs, shuffle=True, num_workers=0, collate_fn=ds.collate)
+
+    # windows of 30 consecutive frames, every 5 frames
+    # ds = LoadWindows(data_path, ds_name='val', window_length=30, window_stride=5)
+
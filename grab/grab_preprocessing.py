@@ -19,24 +19,65 @@ import numpy as np
 import torch
 import os, glob
 import pathlib
-import smplx
 import argparse
+import json
+import shutil
 
 from tqdm import tqdm
-from tools.objectmodel import ObjectModel
+from tools.objectmodel import ObjectBank
+from tools.modelpool import ModelPool
 from tools.cfg_parser import Config
 from tools.utils import makepath, makelogger
 from tools.meshviewer import Mesh
 from tools.utils import parse_npz
 from tools.utils import params2torch
 from tools.utils import prepare_params
-from tools.utils import to_cpu
-from tools.utils import append2dict
-from tools.utils import np2torch
+from tools.utils import frame_runs
+from tools.utils import forward_in_chunks
+from tools.utils import hash_file
+from tools.utils import config_hash, worker_pool
+from tools.writers import SplitWriter, MemmapSplitWriter
+from tools.quantize import select_codec
+from tools.catalog import SequenceCatalog
+from tools.contact import SparseContact
+from tools.vertexsubsets import SUBSET_PARTS, resolve_contact_subsets, subset_vertex_ids
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 INTENTS = ['lift', 'pass', 'offhand', 'use', 'all']
 
+# the fields saved for each data group of a split
+DATA_FIELDS = {
+    'body_data': ['global_orient', 'body_pose', 'transl',
+                  'right_hand_pose', 'left_hand_pose',
+                  'jaw_pose', 'leye_pose', 'reye_pose',
+                  'expression', 'fullpose',
+                  'contact', 'verts'],
+    'rhand_data': ['verts', 'global_orient', 'hand_pose', 'transl', 'fullpose'],
+    'lhand_data': ['verts', 'global_orient', 'hand_pose', 'transl', 'fullpose'],
+    'object_data': ['verts', 'global_orient', 'transl', 'contact'],
+}
+
+# the config keys that change the outputs of a sequence, used for the incremental manifest
+MANIFEST_CFG_KEYS = ['only_contact', 'save_body_verts', 'save_lhand_verts', 'save_rhand_verts',
+                     'save_object_verts', 'save_contact', 'n_verts_sample', 'model_path',
+                     'body_vertex_ids', 'lhand_vertex_ids', 'rhand_vertex_ids', 'contact_format']
+
+# the data groups with contacts, saved in contact_csr.npz with contact_format='csr'
+CONTACT_GROUPS = ['body_data', 'object_data']
+
+# the dataset instance used by each worker process of the sequence pool
+_worker_dataset = None
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+def _process_sequence(sequence):
+    return _worker_dataset.process_sequence(sequence)
+
+def _count_frames(sequence):
+    return _worker_dataset.count_frames(sequence)
+
 class GRABDataSet(object):
 
     def __init__(self, cfg, logger=None, **params):
@@ -66,12 +107,20 @@ class GRABDataSet(object):
             assert isinstance(cfg.splits, dict)
             self.splits = cfg.splits
             
-        self.all_seqs = glob.glob(self.grab_path + '/*/*.npz')
+        if cfg.get('use_catalog', False):
+            # the sequences and their frame counts come from the catalog, without loading the files
+            with SequenceCatalog(self.grab_path, cfg.get('catalog_path'), logger=self.logger) as catalog:
+                self.catalog_rows = {catalog.path(row['sequence']): dict(row) for row in catalog.query()}
+            self.all_seqs = list(self.catalog_rows)
+        else:
+            self.catalog_rows = None
+            self.all_seqs = glob.glob(self.grab_path + '/*/*.npz')
         
         ## to be filled 
         self.selected_seqs = []
         self.obj_based_seqs = {}
         self.sbj_based_seqs = {}
+        self.seq_labels = {}
         self.split_seqs = {'test': [],
                            'val': [],
                            'train': []
@@ -99,142 +148,415 @@ class GRABDataSet(object):
 
         self.subject_mesh = {}
         self.obj_info = {}
+        self.obj_banks = {}
         self.sbj_info = {}
+        self.sbj_meta = {}
+        self.model_pool = ModelPool(cfg.model_path)
+
+        # the vertex subsets of the body and hand models, None computes all the vertices
+        specs = {part: cfg.get('%s_vertex_ids' % part) for part in SUBSET_PARTS}
+        self.vertex_subsets = resolve_contact_subsets(specs, self.selected_seqs, self.logger)
+        # the named regions need the body model and are resolved with the first sequence
+        self.vertex_ids = {part: subset_vertex_ids(spec, None)
+                           for part, spec in self.vertex_subsets.items() if not isinstance(spec, str)}
+
+        incremental = cfg.get('incremental', False)
+        config_hash = self.config_hash()
+        if incremental:
+            self.load_previous_info(config_hash)
+
+        # the storage codecs of the quantized fields, e.g. {'verts': 'int16', 'contact': 'uint8'}
+        codecs = {}
+        for k in set(sum(DATA_FIELDS.values(), [])):
+            codec = select_codec(k, cfg.get('quantize_verts'), cfg.get('quantize_contact'))
+            if codec is not None:
+                codecs[k] = codec
+        # the reused sequences are copied from the previous outputs, which would be quantized twice
+        assert not (codecs and incremental), 'the quantized outputs can not be updated incrementally'
+
+        sparse_contact = cfg.save_contact and cfg.get('contact_format', 'dense') == 'csr'
+
+        num_workers = cfg.get('num_workers', 0)
+        if num_workers > 0:
+            self.logger('Processing sequences with %d workers.' % num_workers)
+
+        with worker_pool(num_workers, initializer=_init_worker, initargs=(self,)) as pool:
+            for split in self.split_seqs.keys():
+
+                self.logger('Processing data for %s split.' % (split))
+
+                frame_names = []
+                runs = []
+                seq_frames = []
+                split_path = os.path.join(self.out_path, split)
+                write_path = split_path
+
+                split_seqs = self.split_seqs[split]
+                seq_keys = [os.path.relpath(sequence, self.grab_path) for sequence in split_seqs]
+
+                # sequences with unchanged inputs and config are copied from the previous outputs
+                reused = [None] * len(split_seqs)
+                if incremental:
+                    manifest = self.load_manifest(split_path)
+                    prev_data = self.load_split_arrays(split_path)
+                    input_hashes = [hash_file(sequence) for sequence in split_seqs]
+                    for idx, key in enumerate(seq_keys):
+                        entry = manifest.get(key)
+                        if entry is not None and prev_data is not None and 'runs' in entry \
+                                and entry['input_hash'] == input_hashes[idx] \
+                                and entry['config_hash'] == config_hash:
+                            reused[idx] = entry
+                    if prev_data is not None:
+                        write_path = split_path + '_tmp'
+                    self.logger('Reusing %d of %d sequences for %s split.'
+                                % (len(reused) - reused.count(None), len(reused), split))
+
+                todo_seqs = [sequence for sequence, entry in zip(split_seqs, reused) if entry is None]
+
+                export_npy = cfg.get('export_format', 'pt') == 'npy'
+                if cfg.get('streaming_writer', False) or incremental or export_npy:
+                    # first pass: count the selected frames to preallocate the split outputs
+                    if pool is None:
+                        frame_counts = list(map(self.count_frames, todo_seqs))
+                    else:
+                        frame_counts = pool.map(_count_frames, todo_seqs)
+                    n_frames = sum(frame_counts) + sum(entry['n_frames'] for entry in reused if entry is not None)
+                    writer = MemmapSplitWriter(write_path, DATA_FIELDS, n_frames, save_pt=not export_npy, codecs=codecs)
+                else:
+                    writer = SplitWriter(write_path, DATA_FIELDS, codecs=codecs)
+
+                # imap keeps the original sequence order, so the merged outputs match the serial path
+                if pool is None:
+                    seq_outs = map(self.process_sequence, todo_seqs)
+                else:
+                    seq_outs = pool.imap(_process_sequence, todo_seqs)
+
+                new_manifest = {}
+                offset = 0
+                # the sparse contacts of each sequence, concatenated at the end of the split
+                contacts = {data_name: [] for data_name in CONTACT_GROUPS}
+                prev_contacts = self.load_split_contacts(split_path) if incremental and sparse_contact else None
+                for idx, sequence in enumerate(tqdm(split_seqs)):
+
+                    entry = reused[idx]
+                    if entry is not None:
+                        T = entry['n_frames']
+                        sbj_id = pathlib.PurePath(sequence).parts[-2]
+                        if T > 0 and sbj_id not in self.sbj_meta:
+                            self.load_sbj_meta(sbj_id, parse_npz(sequence, lazy=True))
+                        for data_name, arrays in prev_data.items():
+                            writer.write(data_name,
+                                         {k: v[entry['offset']:entry['offset'] + T] for k, v in arrays.items()},
+                                         offset)
+                        seq_runs = np.asarray(entry['runs'], dtype=np.int64).reshape(-1, 2)
+                    else:
+                        seq_out = next(seq_outs)
+                        T = 0 if seq_out is None else seq_out['T']
+                        seq_runs = np.zeros((0, 2), dtype=np.int64) if seq_out is None else seq_out['runs']
+
+                    if incremental:
+                        new_manifest[seq_keys[idx]] = {'input_hash': input_hashes[idx],
+                                                       'config_hash': config_hash,
+                                                       'offset': int(offset),
+                                                       'n_frames': int(T),
+                                                       'runs': seq_runs.tolist()}
+
+                    if T < 1:
+                        continue # if no frame is selected continue to the next sequence
+
+                    if entry is None:
+                        self.sbj_info.setdefault(seq_out['sbj_id'], seq_out['sbj_vtemp'])
+                        self.sbj_meta.setdefault(seq_out['sbj_id'], seq_out['sbj_meta'])
+                        self.obj_info.setdefault(seq_out['obj_name'], seq_out['obj_info'])
+                        for part, vertex_ids in seq_out['vertex_ids'].items():
+                            self.vertex_ids.setdefault(part, vertex_ids)
+
+                        for data_name in DATA_FIELDS:
+                            writer.write(data_name, seq_out['params'][data_name], offset)
+                            writer.write(data_name, seq_out['extras'][data_name], offset)
+
+                        if sparse_contact:
+                            for data_name in CONTACT_GROUPS:
+                                contacts[data_name].append(seq_out['contacts'][data_name])
+
+                    elif sparse_contact:
+                        for data_name in CONTACT_GROUPS:
+                            contacts[data_name].append(prev_contacts[data_name].rows(entry['offset'], entry['offset'] + T))
+
+                    # the runs of consecutive frames, with their first frame in the split and in the sequence
+                    run_offsets = offset + np.cumsum(seq_runs[:, 1]) - seq_runs[:, 1]
+                    runs.append(np.stack([run_offsets, seq_runs[:, 1], seq_runs[:, 0]], axis=1))
+
+                    seq_frames.append((sequence, T))
+
+                    offset += T
+                    frame_names.extend(['%s_%s' % (sequence.split('.')[0], fId) for fId in np.arange(T)])
+
+
+                self.logger('Processing for %s split finished' % split)
+                self.logger('Total number of frames for %s split is:%d' % (split, len(frame_names)))
+
+                codec_params = writer.close()
+                prev_data = None
+
+                for data_name, fields in codec_params.items():
+                    for k, meta in fields.items():
+                        self.logger('%s %s stored as %s, max error: %g' % (data_name, k, meta['codec'], meta['max_error']))
+
+                np.savez(os.path.join(write_path, 'frame_names.npz'), frame_names=frame_names)
+
+                runs = np.concatenate(runs) if runs else np.zeros((0, 3), dtype=np.int64)
+                np.savez(os.path.join(write_path, 'frame_runs.npz'),
+                         run_starts=runs[:, 0], run_lengths=runs[:, 1], run_frames=runs[:, 2])
+
+                self.save_frame_index(os.path.join(write_path, 'frame_index.npz'), seq_frames)
+
+                if sparse_contact and contacts['body_data']:
+                    # saved by the data group name of LoadData, e.g. body_indptr
+                    arrays = {}
+                    for data_name in CONTACT_GROUPS:
+                        arrays.update(SparseContact.concatenate(contacts[data_name]).to_arrays(data_name.split('_')[0]))
+                    np.savez(os.path.join(write_path, 'contact_csr.npz'), **arrays)
+
+                if incremental:
+                    with open(os.path.join(write_path, 'manifest.json'), 'w') as f:
+                        json.dump({'config_hash': config_hash, 'sequences': new_manifest}, f, indent=1)
+                    if write_path != split_path:
+                        # swap in the new outputs only once they are complete
+                        shutil.rmtree(split_path)
+                        os.rename(write_path, split_path)
 
-        for split in self.split_seqs.keys():
-
-            self.logger('Processing data for %s split.' % (split))
-
-            frame_names = []
-            body_data = {
-                'global_orient': [],'body_pose': [],'transl': [],
-                'right_hand_pose': [],'left_hand_pose': [],
-                'jaw_pose': [],'leye_pose': [],'reye_pose': [],
-                'expression': [],'fullpose': [],
-                'contact':[], 'verts' :[]
-            }
-
-            object_data ={'verts': [], 'global_orient': [], 'transl': [], 'contact': []}
-            lhand_data = {'verts': [], 'global_orient': [], 'hand_pose': [], 'transl': [], 'fullpose': []}
-            rhand_data = {'verts': [], 'global_orient': [], 'hand_pose': [], 'transl': [], 'fullpose': []}
-
-            for sequence in tqdm(self.split_seqs[split]):
-
-                seq_data = parse_npz(sequence)
-
-                obj_name = seq_data.obj_name
-                sbj_id   = seq_data.sbj_id
-                n_comps  = seq_data.n_comps
-                gender   = seq_data.gender
-
-                frame_mask = self.filter_contact_frames(seq_data)
-
-                # total selectd frames
-                T = frame_mask.sum()
-                if T < 1:
-                    continue # if no frame is selected continue to the next sequence
-
-                sbj_params = prepare_params(seq_data.body.params, frame_mask)
-                rh_params  = prepare_params(seq_data.rhand.params, frame_mask)
-                lh_params  = prepare_params(seq_data.lhand.params, frame_mask)
-                obj_params = prepare_params(seq_data.object.params, frame_mask)
-
-                append2dict(body_data, sbj_params)
-                append2dict(rhand_data, rh_params)
-                append2dict(lhand_data, lh_params)
-                append2dict(object_data, obj_params)
-
-                sbj_vtemp = self.load_sbj_verts(sbj_id, seq_data)
-
-                if cfg.save_body_verts:
-
-                    sbj_m = smplx.create(model_path=cfg.model_path,
-                                         model_type='smplx',
-                                         gender=gender,
-                                         num_pca_comps=n_comps,
-                                         v_template=sbj_vtemp,
-                                         batch_size=T)
-
-                    sbj_parms = params2torch(sbj_params)
-                    verts_sbj = to_cpu(sbj_m(**sbj_parms).vertices)
-                    body_data['verts'].append(verts_sbj)
-
-                if cfg.save_lhand_verts:
-                    lh_mesh = os.path.join(grab_path, '..', seq_data.lhand.vtemp)
-                    lh_vtemp = np.array(Mesh(filename=lh_mesh).vertices)
-
-                    lh_m = smplx.create(model_path=cfg.model_path,
-                                        model_type='mano',
-                                        is_rhand=False,
-                                        v_template=lh_vtemp,
-                                        num_pca_comps=n_comps,
-                                        flat_hand_mean=True,
-                                        batch_size=T)
-
-                    lh_parms = params2torch(lh_params)
-                    verts_lh = to_cpu(lh_m(**lh_parms).vertices)
-                    lhand_data['verts'].append(verts_lh)
-
-                if cfg.save_rhand_verts:
-                    rh_mesh = os.path.join(grab_path, '..', seq_data.rhand.vtemp)
-                    rh_vtemp = np.array(Mesh(filename=rh_mesh).vertices)
-
-                    rh_m = smplx.create(model_path=cfg.model_path,
-                                        model_type='mano',
-                                        is_rhand=True,
-                                        v_template=rh_vtemp,
-                                        num_pca_comps=n_comps,
-                                        flat_hand_mean=True,
-                                        batch_size=T)
-
-                    rh_parms = params2torch(rh_params)
-                    verts_rh = to_cpu(rh_m(**rh_parms).vertices)
-                    rhand_data['verts'].append(verts_rh)
-
-                ### for objects
-
-                obj_info = self.load_obj_verts(obj_name, seq_data, cfg.n_verts_sample)
-
-                if cfg.save_object_verts:
-
-                    obj_m = ObjectModel(v_template=obj_info['verts_sample'],
-                                        batch_size=T)
-                    obj_parms = params2torch(obj_params)
-                    verts_obj = to_cpu(obj_m(**obj_parms).vertices)
-                    object_data['verts'].append(verts_obj)
-
-                if cfg.save_contact:
+        np.save(os.path.join(self.out_path, 'obj_info.npy'), self.obj_info)
+        np.save(os.path.join(self.out_path, 'sbj_info.npy'), self.sbj_info)
+        np.save(os.path.join(self.out_path, 'sbj_meta.npy'), self.sbj_meta)
+        # the vertices computed for each part with a subset, read by LoadData
+        vertex_ids = {part: ids for part, ids in self.vertex_ids.items() if ids is not None}
+        if vertex_ids:
+            np.savez(os.path.join(self.out_path, 'vertex_ids.npz'), **vertex_ids)
 
-                    body_data['contact'].append(seq_data.contact.body[frame_mask])
-                    object_data['contact'].append(seq_data.contact.object[frame_mask][:,obj_info['verts_sample_id']])
+    def save_frame_index(self, outfname, seq_frames):
+        '''
+        save the sequence, subject, object and intent of each frame of a split as integer arrays,
+        with the names of each of them, so LoadData and the samplers do not parse the frame names
+        :param seq_frames: list of (sequence, number of frames) in the order of the split
+        '''
+        lengths = np.array([T for _, T in seq_frames], dtype=np.int64)
+        frame_seqs = np.repeat(np.arange(len(seq_frames)), lengths)
+        frame_ids = np.concatenate([np.arange(T) for T in lengths]) if len(lengths) else np.zeros(0)
 
-                frame_names.extend(['%s_%s' % (sequence.split('.')[0], fId) for fId in np.arange(T)])
+        index = {'seq_names': np.array([sequence.split('.')[0] for sequence, _ in seq_frames], dtype=str),
+                 'frame_seqs': frame_seqs.astype(np.int32),
+                 'frame_ids': frame_ids.astype(np.int32)}
 
+        for i, (names, frame_name) in enumerate([('sbjs', 'frame_sbjs'), ('objs', 'frame_objs'),
+                                                 ('intents', 'frame_intents')]):
+            labels = np.array([self.seq_labels[sequence][i] for sequence, _ in seq_frames], dtype=str)
+            index[names], seq_ids = np.unique(labels, return_inverse=True)
+            index[frame_name] = seq_ids[frame_seqs].astype(np.int32)
 
-            self.logger('Processing for %s split finished' % split)
-            self.logger('Total number of frames for %s split is:%d' % (split, len(frame_names)))
+        np.savez(outfname, **index)
 
+    def config_hash(self):
+        return config_hash(self.cfg, MANIFEST_CFG_KEYS)
 
-            out_data = [body_data, rhand_data, lhand_data, object_data]
-            out_data_name = ['body_data', 'rhand_data', 'lhand_data', 'object_data']
+    def load_manifest(self, split_path):
+        manifest_path = os.path.join(split_path, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path, 'r') as f:
+            return json.load(f)['sequences']
 
-            for idx, data in enumerate(out_data):
-                data = np2torch(data)
-                data_name = out_data_name[idx]
-                outfname = makepath(os.path.join(self.out_path, split, '%s.pt' % data_name), isfile=True)
-                torch.save(data, outfname)
+    def load_split_arrays(self, split_path):
+        '''
+        open the per-field .npy outputs of a previous run as memory-mapped arrays
+        :return: dict of dicts with the arrays of each data group, or None if there are no previous outputs
+        '''
+        if not os.path.exists(os.path.join(split_path, 'manifest.json')):
+            return None
+        arrays = {}
+        for data_name in DATA_FIELDS:
+            arrays[data_name] = {}
+            for k in DATA_FIELDS[data_name]:
+                field_path = os.path.join(split_path, data_name, '%s.npy' % k)
+                if os.path.exists(field_path):
+                    arrays[data_name][k] = np.load(field_path, mmap_mode='r')
+        return arrays
+
+    def load_split_contacts(self, split_path):
+        '''
+        the sparse contacts of a previous run, for the reused sequences
+        '''
+        contact_path = os.path.join(split_path, 'contact_csr.npz')
+        if not os.path.exists(contact_path):
+            return None
+        with np.load(contact_path) as arrays:
+            return {data_name: SparseContact.from_arrays(arrays, data_name.split('_')[0])
+                    for data_name in CONTACT_GROUPS}
+
+    def load_previous_info(self, config_hash):
+        '''
+        load the object and subject info of a previous run with the same config,
+        so reused sequences keep the same object vertex samples
+        '''
+        for split in self.split_seqs.keys():
+            manifest_path = os.path.join(self.out_path, split, 'manifest.json')
+            if not os.path.exists(manifest_path):
+                return
+            with open(manifest_path, 'r') as f:
+                if json.load(f)['config_hash'] != config_hash:
+                    return
+        self.obj_info = np.load(os.path.join(self.out_path, 'obj_info.npy'), allow_pickle=True).item()
+        self.sbj_info = np.load(os.path.join(self.out_path, 'sbj_info.npy'), allow_pickle=True).item()
+        sbj_meta_path = os.path.join(self.out_path, 'sbj_meta.npy')
+        if os.path.exists(sbj_meta_path):
+            self.sbj_meta = np.load(sbj_meta_path, allow_pickle=True).item()
+        vertex_ids_path = os.path.join(self.out_path, 'vertex_ids.npz')
+        if os.path.exists(vertex_ids_path):
+            with np.load(vertex_ids_path) as vertex_ids:
+                self.vertex_ids = {part: vertex_ids[part] for part in vertex_ids.files}
+
+    def process_sequence(self, sequence):
+        '''
+        parse, mask and run the body, hand and object models for a single sequence
+        :param sequence: path to the sequence npz file
+        :return: the masked params and the computed vertices/contacts, or None if no frame is selected
+        '''
+        cfg = self.cfg
+
+        seq_data = parse_npz(sequence)
+
+        obj_name = seq_data.obj_name
+        sbj_id   = seq_data.sbj_id
+        n_comps  = seq_data.n_comps
+        gender   = seq_data.gender
+
+        frame_mask = self.filter_contact_frames(seq_data)
+
+        # total selectd frames
+        T = frame_mask.sum()
+        if T < 1:
+            return None
+
+        sbj_params = prepare_params(seq_data.body.params, frame_mask)
+        rh_params  = prepare_params(seq_data.rhand.params, frame_mask)
+        lh_params  = prepare_params(seq_data.lhand.params, frame_mask)
+        obj_params = prepare_params(seq_data.object.params, frame_mask)
+
+        body_extras, rhand_extras, lhand_extras, object_extras = {}, {}, {}, {}
+
+        # the models run on chunks of frames to bound the memory of long sequences
+        chunk_size = cfg.get('forward_chunk_size', 0)
+
+        sbj_vtemp = self.load_sbj_verts(sbj_id, seq_data)
+        sbj_meta = self.load_sbj_meta(sbj_id, seq_data)
+
+        if cfg.save_body_verts or 'body' not in self.vertex_ids:
+            sbj_mesh = os.path.join(self.grab_path, '..', seq_data.body.vtemp)
+            sbj_m = self.model_pool.get('smplx', sbj_mesh,
+                                        gender=gender,
+                                        n_comps=n_comps,
+                                        v_template=sbj_vtemp)
+            self.part_vertex_ids('body', sbj_m)
+
+        if cfg.save_body_verts:
+            sbj_parms = params2torch(sbj_params)
+            body_extras['verts'] = forward_in_chunks(self.part_forward('body', sbj_m),
+                                                     sbj_parms, chunk_size)['vertices']
+
+        if cfg.save_lhand_verts:
+            lh_mesh = os.path.join(self.grab_path, '..', seq_data.lhand.vtemp)
+            lh_m = self.model_pool.get('mano', lh_mesh,
+                                       is_rhand=False,
+                                       n_comps=n_comps)
+
+            lh_parms = params2torch(lh_params)
+            lhand_extras['verts'] = forward_in_chunks(self.part_forward('lhand', lh_m),
+                                                      lh_parms, chunk_size)['vertices']
+
+        if cfg.save_rhand_verts:
+            rh_mesh = os.path.join(self.grab_path, '..', seq_data.rhand.vtemp)
+            rh_m = self.model_pool.get('mano', rh_mesh,
+                                       is_rhand=True,
+                                       n_comps=n_comps)
+
+            rh_parms = params2torch(rh_params)
+            rhand_extras['verts'] = forward_in_chunks(self.part_forward('rhand', rh_m),
+                                                      rh_parms, chunk_size)['vertices']
+
+        ### for objects
+
+        obj_info = self.load_obj_verts(obj_name, seq_data, cfg.n_verts_sample)
+
+        if cfg.save_object_verts:
+            # a single rigid transform of the object bank for each chunk of frames
+            obj_parms = params2torch({k: obj_params[k] for k in ['global_orient', 'transl']})
+            obj_parms['object_ids'] = torch.zeros(T, dtype=torch.long)
+            object_extras['verts'] = forward_in_chunks(lambda p: self.object_bank(obj_name)(**p),
+                                                       obj_parms, chunk_size)['vertices']
+
+        if cfg.save_contact:
+
+            body_extras['contact'] = seq_data.contact.body[frame_mask]
+            # the body contacts are kept for the same vertices as the body vertices
+            if self.vertex_ids['body'] is not None:
+                body_extras['contact'] = body_extras['contact'][:, self.vertex_ids['body']]
+            object_extras['contact'] = seq_data.contact.object[frame_mask][:,obj_info['verts_sample_id']]
+
+        contacts = None
+        if cfg.save_contact and cfg.get('contact_format', 'dense') == 'csr':
+            # the contacts are saved apart from the other fields, only for the vertices in contact
+            contacts = {'body_data': SparseContact.from_dense(body_extras.pop('contact')),
+                        'object_data': SparseContact.from_dense(object_extras.pop('contact'))}
+
+        return {'T': T,
+                'runs': frame_runs(frame_mask),
+                'sbj_id': sbj_id,
+                'sbj_vtemp': sbj_vtemp,
+                'sbj_meta': sbj_meta,
+                'obj_name': obj_name,
+                'obj_info': obj_info,
+                'vertex_ids': self.vertex_ids,
+                'contacts': contacts,
+                'params': {'body_data': sbj_params, 'rhand_data': rh_params,
+                           'lhand_data': lh_params, 'object_data': obj_params},
+                'extras': {'body_data': body_extras, 'rhand_data': rhand_extras,
+                           'lhand_data': lhand_extras, 'object_data': object_extras}}
+
+    def object_bank(self, obj_name):
+        '''
+        the ObjectBank of the sampled vertices of an object, built once for each process
+        '''
+        if obj_name not in self.obj_banks:
+            self.obj_banks[obj_name] = ObjectBank([self.obj_info[obj_name]['verts_sample']])
+        return self.obj_banks[obj_name]
 
-            np.savez(os.path.join(self.out_path, split, 'frame_names.npz'), frame_names=frame_names)
+    def part_vertex_ids(self, part, model):
+        '''
+        the vertex ids of the subset of a part of SUBSET_PARTS, or None for all the vertices
+        '''
+        if part not in self.vertex_ids:
+            self.vertex_ids[part] = subset_vertex_ids(self.vertex_subsets[part], model)
+        return self.vertex_ids[part]
 
-        np.save(os.path.join(self.out_path, 'obj_info.npy'), self.obj_info)
-        np.save(os.path.join(self.out_path, 'sbj_info.npy'), self.sbj_info)
+    def part_forward(self, part, model):
+        '''
+        the forward function of a body or hand model, computing only the vertices of the subset of the part
+        '''
+        vertex_ids = self.part_vertex_ids(part, model)
+        if vertex_ids is None:
+            return lambda p: self.model_pool.forward(model, p)
+        return self.model_pool.sparse(model, vertex_ids)
 
     def process_sequences(self):
 
         for sequence in self.all_seqs:
-            subject_id = pathlib.PurePath(sequence).parts[-2]
-            action_name = os.path.basename(sequence)
-            object_name = action_name.split('_')[0]
+            if self.catalog_rows is not None:
+                row = self.catalog_rows[sequence]
+                subject_id, action_name, object_name = row['subject'], row['action'], row['object']
+            else:
+                subject_id = pathlib.PurePath(sequence).parts[-2]
+                action_name = os.path.basename(sequence)
+                object_name = action_name.split('_')[0]
 
             # filter data based on the motion intent
             if self.intent == 'all':
@@ -244,6 +566,10 @@ class GRABDataSet(object):
             elif self.intent not in action_name:
                 continue
 
+            # the subject, object and intent of each sequence, saved as integer indices of the frames
+            intent = next((intnt for intnt in INTENTS[:3] if intnt in action_name), 'use')
+            self.seq_labels[sequence] = (subject_id, object_name, intent)
+
             # group motion sequences based on objects
             if object_name not in self.obj_based_seqs:
                 self.obj_based_seqs[object_name] = [sequence]
@@ -267,6 +593,14 @@ class GRABDataSet(object):
                 if object_name not in self.splits['train']:
                     self.splits['train'].append(object_name)
 
+    def count_frames(self, sequence):
+        if self.catalog_rows is not None:
+            row = self.catalog_rows[sequence]
+            return row['n_contact_frames'] if self.cfg.only_contact else row['n_frames']
+        # only the contact entry is decoded
+        seq_data = parse_npz(sequence, lazy=True)
+        return int(self.filter_contact_frames(seq_data).sum())
+
     def filter_contact_frames(self, seq_data):
         if self.cfg.only_contact:
             frame_mask = (seq_data['contact']['object']>0).any(axis=1)
@@ -297,6 +631,23 @@ class GRABDataSet(object):
 
         return self.obj_info[obj_name]
 
+    def load_sbj_meta(self, sbj_id, seq_data):
+        '''
+        the model settings and hand templates of a subject, used by LoadData to compute
+        the vertices from the saved parameters
+        '''
+        if sbj_id not in self.sbj_meta:
+            self.sbj_meta[sbj_id] = {
+                'gender': str(seq_data.gender),
+                'n_comps': int(seq_data.n_comps),
+                'body_vtemp': str(seq_data.body.vtemp),
+                'rhand_vtemp': str(seq_data.rhand.vtemp),
+                'lhand_vtemp': str(seq_data.lhand.vtemp),
+                'rhand_verts': np.array(Mesh(filename=os.path.join(self.grab_path, '..', seq_data.rhand.vtemp)).vertices),
+                'lhand_verts': np.array(Mesh(filename=os.path.join(self.grab_path, '..', seq_data.lhand.vtemp)).vertices),
+            }
+        return self.sbj_meta[sbj_id]
+
     def load_sbj_verts(self, sbj_id, seq_data):
 
         mesh_path = os.path.join(self.grab_path, '..',seq_data.body.vtemp)
@@ -322,7 +673,8 @@ if __name__ == '__main__':
         c) which data splits
             and etc
         
-        WARNING: saving vertices requires a high-capacity RAM memory.
+        WARNING: saving vertices requires a high-capacity RAM memory,
+                 unless the streaming_writer option is used.
         
     4. In case you need body or hand vertices make sure to set the model_path
         to the models downloaded from smplx website 
@@ -340,12 +692,15 @@ if __name__ == '__main__':
                         help='The path to the folder to save the processed data')
     parser.add_argument('--model-path', required=True, type=str,
                         help='The path to the folder containing smplx models')
+    parser.add_argument('--num-workers', default=0, type=int,
+                        help='The number of processes used to process the sequences')
 
     args = parser.parse_args()
 
     grab_path = args.grab_path
     out_path = args.out_path
     model_path = args.model_path
+    num_workers = args.num_workers
     process_id = 'GRAB_V00' # choose an appropriate ID for the processed data
 
 
@@ -382,6 +737,44 @@ if __name__ == '__main__':
         # number of vertices samples for each object
         'n_verts_sample': 1024,
 
+        # number of worker processes for the sequences, 0 processes them serially
+        'num_workers': num_workers,
+
+        # number of frames in each body, hand, and object forward pass, 0 runs all the frames at once
+        'forward_chunk_size': 256,
+
+        # if True, counts the frames first and writes each sequence directly to
+        # memory-mapped .npy files, instead of keeping the whole split in memory
+        'streaming_writer': False,
+
+        # if True, lists the sequences and their frame counts from the sequence catalog
+        # (built once in grab_catalog.sqlite next to the grab folder) instead of loading every file
+        'use_catalog': False,
+
+        # if True, only recomputes the sequences whose inputs or config changed since the last run
+        # and copies the others from the previous outputs (uses the streaming writer)
+        'incremental': False,
+
+        # 'pt' saves a .pt file for each data group, 'npy' saves only one .npy file per field
+        # and a schema.json, to be opened with LoadData(load_mode='memmap') (uses the streaming writer)
+        'export_format': 'pt',
+
+        # storage codec of the vertices and translations: None, 'float16' or 'int16' (with a scale and offset per field),
+        # and of the contacts: None, 'uint8' or 'bitpack' (only in contact or not). LoadData decodes them
+        'quantize_verts': None,
+        'quantize_contact': None,
+
+        # the vertices computed and saved for the body and the hands: None for all of them, a list of vertex ids,
+        # a region of tools.vertexsubsets.REGIONS for the body (e.g. 'hands'), or {'contact': 0.01} for the body
+        # vertices in contact in at least 1% of the frames. The body contacts are kept for the same vertices
+        'body_vertex_ids': None,
+        'lhand_vertex_ids': None,
+        'rhand_vertex_ids': None,
+
+        # 'dense' saves the contacts with the other fields, 'csr' only the vertices in contact in each frame and
+        # their labels, in contact_csr.npz. LoadData unpacks them to the same dense contacts
+        'contact_format': 'dense',
+
         # body and hand model path
         'model_path':model_path,
     }
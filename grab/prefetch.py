@@ -0,0 +1,180 @@
+
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import sys
+sys.path.append('.')
+sys.path.append('..')
+
+import queue
+import threading
+import torch
+
+from grab.dataloader import LoadData
+
+
+class PrefetchLoader(object):
+
+    def __init__(self, dataset, batch_sampler, n_prefetch=2, pin_memory=True):
+        ''' Iterator over the batches of a LoadData dataset, prepared in a background thread
+
+            The next n_prefetch batches are gathered while the current one is used, into
+            n_prefetch + 1 buffers that are allocated on the first batch (pinned if CUDA is
+            available) and reused for the whole epoch. The tensors of a batch are only valid
+            until the next batch is requested, so they should be moved to the device
+            (e.g. with non_blocking=True) or copied before that.
+
+                Parameters
+                ----------
+                dataset: LoadData
+                    The dataset, its get_batch and collate are used for each batch
+                batch_sampler: iterable
+                    Yields the frame indices of each batch, e.g. a BatchSampler or a GroupBatchSampler
+                n_prefetch: int
+                    The number of batches prepared ahead
+                pin_memory: bool
+                    If True and CUDA is available, the buffers are in pinned memory
+            '''
+
+        self.dataset = dataset
+        self.batch_sampler = batch_sampler
+        self.n_prefetch = n_prefetch
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.buffers = [None] * (n_prefetch + 1)
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+
+        free, ready = queue.Queue(), queue.Queue()
+        for buffer_id in range(len(self.buffers)):
+            free.put((buffer_id, None))
+        stop = threading.Event()
+
+        thread = threading.Thread(target=self.produce, args=(free, ready, stop), daemon=True)
+        thread.start()
+
+        current = None
+        try:
+            while True:
+                item = ready.get()
+                if current is not None:
+                    self.release(free, current)
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                current, batch_size = item
+                yield self.narrow(self.buffers[current], batch_size)
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, free, buffer_id):
+        # the pending copies of the consumer to the device must be done before the buffer is reused
+        event = None
+        if self.pin_memory:
+            event = torch.cuda.current_stream().record_event()
+        free.put((buffer_id, event))
+
+    def produce(self, free, ready, stop):
+        try:
+            for indices in self.batch_sampler:
+                while True:
+                    try:
+                        buffer_id, event = free.get(timeout=.1)
+                        break
+                    except queue.Empty:
+                        if stop.is_set():
+                            return
+                if stop.is_set():
+                    return
+                if event is not None:
+                    event.synchronize()
+
+                indices = torch.as_tensor(indices, dtype=torch.long)
+                self.fill(buffer_id, indices)
+                ready.put((buffer_id, len(indices)))
+        except Exception as e:
+            ready.put(e)
+            return
+        ready.put(None)
+
+    def fill(self, buffer_id, indices):
+
+        buffer = self.buffers[buffer_id]
+        dataset = self.dataset
+
+        fits = buffer is not None and buffer['idx'].shape[0] >= len(indices)
+
+        if fits and type(dataset) is LoadData and dataset.decoder is None and not dataset.codecs and not dataset.contacts:
+            # the frames are gathered directly into the buffer, without intermediate tensors
+            self.gather(dataset.ds, indices, buffer)
+            buffer['idx'][:len(indices)].copy_(indices)
+            return
+
+        batch = dataset.collate(dataset.get_batch(indices))
+        if not fits:
+            buffer = self.buffers[buffer_id] = self.empty_like(batch)
+        self.copy(batch, buffer)
+
+    def gather(self, source, indices, out):
+        for k, v in source.items():
+            if isinstance(v, dict):
+                self.gather(v, indices, out[k])
+            else:
+                torch.index_select(v, 0, indices, out=out[k][:len(indices)])
+
+    def copy(self, source, out):
+        for k, v in source.items():
+            if isinstance(v, dict):
+                self.copy(v, out[k])
+            else:
+                out[k][:v.shape[0]].copy_(v)
+
+    def empty_like(self, source):
+        out = {}
+        for k, v in source.items():
+            if isinstance(v, dict):
+                out[k] = self.empty_like(v)
+            else:
+                out[k] = torch.empty(v.shape, dtype=v.dtype, pin_memory=self.pin_memory)
+        return out
+
+    def narrow(self, source, batch_size):
+        out = {}
+        for k, v in source.items():
+            if isinstance(v, dict):
+                out[k] = self.narrow(v, batch_size)
+            else:
+                out[k] = v[:batch_size]
+        return out
+
+
+if __name__ == '__main__':
+
+    from torch.utils import data
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    data_path = 'PATH_TO_PROCESSED_DATA/grab_processed'
+    ds = LoadData(data_path, ds_name='val')
+
+    bs = 256
+    batch_sampler = data.BatchSampler(data.RandomSampler(ds), batch_size=bs, drop_last=True)
+    loader = PrefetchLoader(ds, batch_sampler, n_prefetch=2)
+
+    for batch in loader:
+        # the buffers are reused, move the batch to the device before the next one
+        body_verts = batch['body']['verts'].to(device, non_blocking=True)
@@ -0,0 +1,110 @@
+
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import numpy as np
+import torch
+from torch.utils import data
+
+# the per-frame group arrays of LoadData and their names
+GROUPS = {'seq': ('frame_seqs', 'seq_names'),
+          'sbj': ('frame_sbjs', 'sbjs'),
+          'obj': ('frame_objs', 'objs'),
+          'intent': ('frame_intents', 'intents')}
+
+
+class GroupBatchSampler(data.Sampler):
+
+    def __init__(self,
+                 dataset,
+                 group_by='obj',
+                 batch_size=256,
+                 groups=None,
+                 balanced=True,
+                 n_batches=None,
+                 seed=None):
+        ''' Batches of frames drawn by subject, object, intent or sequence
+
+            The frames of each group are sorted once, so each batch is drawn in O(batch_size)
+            from the precomputed indices of LoadData, without scanning all the frames.
+            The batches are tensors of frame indices, for DataLoader(batch_sampler=...) or
+            DataLoader(sampler=..., batch_size=None) with the batched fetch of LoadData.
+
+                Parameters
+                ----------
+                dataset: LoadData
+                    The dataset to sample from
+                group_by: str
+                    'sbj', 'obj', 'intent' or 'seq'
+                batch_size: int
+                    The number of frames in each batch
+                groups: list, optional
+                    The names of the groups to sample from, e.g. ['s1', 's2'], by default all of them
+                balanced: bool
+                    If True, each frame is drawn from a uniformly chosen group, otherwise
+                    the frames of the selected groups are drawn uniformly
+                n_batches: int, optional
+                    The number of batches of an epoch, by default the number of selected frames
+                    divided by batch_size
+                seed: int, optional
+                    The seed of the random generator
+            '''
+
+        frame_name, names_name = GROUPS[group_by]
+        frame_groups = getattr(dataset, frame_name)
+        if frame_groups is None:
+            raise ValueError('the dataset has no %s, preprocess it again to save frame_index.npz' % frame_name)
+        names = list(getattr(dataset, names_name))
+
+        frame_groups = torch.as_tensor(frame_groups, dtype=torch.long)
+        self.order = torch.argsort(frame_groups, stable=True)
+        self.sizes = torch.bincount(frame_groups, minlength=len(names))
+        self.starts = torch.cumsum(self.sizes, 0) - self.sizes
+
+        if groups is None:
+            group_ids = torch.arange(len(names))
+        else:
+            group_ids = torch.tensor([names.index(name) for name in groups], dtype=torch.long)
+        self.group_ids = group_ids[self.sizes[group_ids] > 0]
+        if len(self.group_ids) == 0:
+            raise ValueError('no frame to sample from, the dataset or the selected %s groups are empty' % group_by)
+
+        self.batch_size = batch_size
+        self.balanced = balanced
+        if not balanced:
+            self.frames = torch.cat([self.order[self.starts[g]:self.starts[g] + self.sizes[g]]
+                                     for g in self.group_ids])
+
+        n_frames = int(self.sizes[self.group_ids].sum())
+        self.n_batches = n_batches if n_batches is not None else max(n_frames // batch_size, 1)
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(np.random.randint(2 ** 31) if seed is None else seed)
+
+    def sample(self):
+        '''
+        draw the frame indices of a single batch
+        '''
+        if not self.balanced:
+            return self.frames[torch.randint(len(self.frames), (self.batch_size,), generator=self.generator)]
+
+        groups = self.group_ids[torch.randint(len(self.group_ids), (self.batch_size,), generator=self.generator)]
+        offsets = (torch.rand(self.batch_size, generator=self.generator) * self.sizes[groups]).to(torch.long)
+        return self.order[self.starts[groups] + offsets]
+
+    def __iter__(self):
+        for _ in range(self.n_batches):
+            yield self.sample()
+
+    def __len__(self):
+        return self.n_batches
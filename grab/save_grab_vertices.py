@@ -21,21 +21,99 @@ import os, sys, glob
 import smplx
 import smplx.joint_names
 import argparse
-import gc
+import pathlib
 
 from tqdm import tqdm
 from tools.objectmodel import ObjectModel
+from tools.modelpool import ModelPool
+from tools.catalog import SequenceCatalog
 from tools.cfg_parser import Config
 from tools.utils import makepath, makelogger
 from tools.meshviewer import Mesh
 from tools.utils import parse_npz
 from tools.utils import params2torch
 from tools.utils import to_cpu
+from tools.utils import forward_in_chunks
+from tools.utils import config_hash, worker_pool
+from tools.quantize import encode_arrays
+from tools import arrayio
+from tools.contact import SparseContact
+from tools.vertexsubsets import SUBSET_PARTS, resolve_contact_subsets, subset_vertex_ids
 import tools.consts
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 
+# the outputs of each sequence, saved as <sequence>_<output>.npz
+OUTPUTS = ['metadata', 'verts_body', 'hand_joints', 'contact_info', 'verts_lhand', 'verts_rhand', 'verts_object']
+
+def output_codec(cfg, outfname):
+    '''
+    the file codec of an output, output_codec is either a codec name or a dict with a codec for each output
+    '''
+    codec = cfg.get('output_codec') or 'npz'
+    if isinstance(codec, dict):
+        output = next(output for output in OUTPUTS if outfname.endswith('_%s.npz' % output))
+        codec = codec.get(output, 'npz')
+    return codec
+
+def save_arrays(outfname, cfg, logger, **arrays):
+    '''
+    save the outputs of a sequence, with the storage and file codecs of cfg (read them with tools.arrayio.load_arrays)
+    '''
+    arrays, codecs = encode_arrays(arrays, cfg.get('quantize_verts'), cfg.get('quantize_contact'))
+    for name, meta in codecs.items():
+        logger('%s stored as %s, max error: %g' % (name, meta['codec'], meta['max_error']))
+    # written to a temporary file first, so an interrupted run never leaves a truncated output
+    tmpfname = outfname[:-len('.npz')] + '.tmp.npz'
+    arrayio.save_arrays(tmpfname, arrays, codec=output_codec(cfg, outfname), n_threads=codec_threads(cfg))
+    os.replace(tmpfname, outfname)
+
+def codec_threads(cfg):
+    '''
+    the compression threads of each process, by default the cpus are divided between the worker processes
+    '''
+    n_threads = cfg.get('codec_threads')
+    if not n_threads and cfg.get('num_workers', 0) > 1:
+        n_threads = max(1, (os.cpu_count() or 1) // cfg.num_workers)
+    return n_threads or None
+
+
+# the config entries that change the outputs, a change of them invalidates the journal
+JOURNAL_CFG_KEYS = ['save_body_verts', 'save_object_verts', 'save_lhand_verts', 'save_rhand_verts',
+                    'save_hand_joints', 'save_contact', 'save_metadata', 'n_verts_sample', 'model_path',
+                    'quantize_verts', 'quantize_contact', 'output_codec', 'contact_format',
+                    'body_vertex_ids', 'lhand_vertex_ids', 'rhand_vertex_ids']
+
+def sequence_key(sequence, grab_path):
+    return pathlib.PurePath(os.path.relpath(sequence, grab_path)).as_posix()
+
+def load_journal(journal_path, journal_hash):
+    '''
+    the sequences finished by previous runs with the same config
+    '''
+    if not os.path.exists(journal_path):
+        return set()
+    done = set()
+    with open(journal_path, 'r') as f:
+        for line in f:
+            entry = line.rstrip('\n').split(' ', 1)
+            if len(entry) == 2 and entry[0] == journal_hash:
+                done.add(entry[1])
+    return done
+
+# the config, output path and models of each worker process
+_worker_state = None
+
+def _init_worker(cfg, out_path, vertex_subsets):
+    global _worker_state
+    _worker_state = (cfg, ModelPool(cfg.model_path), out_path, vertex_subsets)
+
+def _process_sequence(sequence):
+    cfg, model_pool, out_path, vertex_subsets = _worker_state
+    return sequence, process_sequence(cfg, sequence, model_pool, out_path, vertex_subsets)
+
+
 def save_grab_vertices(cfg, logger=None, **params):
 
     grab_path = cfg.grab_path
@@ -49,7 +127,11 @@ def save_grab_vertices(cfg, logger=None, **params):
     logger('Starting to get vertices for GRAB!')
 
         
-    all_seqs = glob.glob(grab_path + '/*/*.npz')
+    if cfg.get('use_catalog', False):
+        with SequenceCatalog(grab_path, cfg.get('catalog_path'), logger=logger) as catalog:
+            all_seqs = catalog.sequences()
+    else:
+        all_seqs = glob.glob(grab_path + '/*/*.npz')
     
 
     logger('Total sequences: %d' % len(all_seqs))
@@ -63,191 +145,292 @@ def save_grab_vertices(cfg, logger=None, **params):
     if out_path is None:
         out_path = grab_path
 
-    for sequence in tqdm(all_seqs):
+    # the finished sequences are listed in a journal, so a restarted run skips them
+    journal_path = os.path.join(out_path, 'save_grab_vertices_journal.txt')
+    journal_hash = config_hash(cfg, JOURNAL_CFG_KEYS)
+    done = set() if cfg.force_reprocess else load_journal(journal_path, journal_hash)
+    todo_seqs = [sequence for sequence in all_seqs if sequence_key(sequence, grab_path) not in done]
+    logger('Skipping %d sequences finished in a previous run.' % (len(all_seqs) - len(todo_seqs)))
+
+    # the vertex subsets of the body and hand models, the contact-frequency ones are computed over all the sequences
+    specs = {part: cfg.get('%s_vertex_ids' % part) for part in SUBSET_PARTS}
+    vertex_subsets = resolve_contact_subsets(specs, all_seqs, logger) if todo_seqs else specs
+
+    num_workers = cfg.get('num_workers', 0)
+    if num_workers > 0:
+        logger('Processing sequences with %d workers.' % num_workers)
+
+    with worker_pool(num_workers, initializer=_init_worker, initargs=(cfg, out_path, vertex_subsets)) as pool, \
+            open(journal_path, 'a') as journal:
+        if pool is not None:
+            # the sequences are taken from a shared queue by the workers, in any order
+            results = pool.imap_unordered(_process_sequence, todo_seqs)
+        else:
+            # the body and hand models are created once and shared across the sequences
+            model_pool = ModelPool(cfg.model_path)
+            results = ((sequence, process_sequence(cfg, sequence, model_pool, out_path, vertex_subsets))
+                       for sequence in todo_seqs)
+
+        for sequence, messages in tqdm(results, total=len(todo_seqs)):
+            for message in messages:
+                logger(message)
+            # a sequence is journaled once all its outputs are written
+            journal.write('%s %s\n' % (journal_hash, sequence_key(sequence, grab_path)))
+            journal.flush()
+
+
+class SequenceForwards(object):
+
+    def __init__(self, seq_data, model_pool, grab_path, chunk_size=0, vertex_subsets=None):
+        ''' The outputs of the body and hand models of a sequence, computed on the first request
+            and shared by all the outputs that use them
+
+                Parameters
+                ----------
+                seq_data: the parsed sequence
+                model_pool: ModelPool
+                grab_path: str
+                    The path to the grab folder, the templates are relative to its parent
+                chunk_size: int
+                    The number of frames in each forward pass, 0 runs all the frames at once
+                vertex_subsets: dict, optional
+                    The vertex subset spec of 'body', 'lhand' and 'rhand' (see tools.vertexsubsets),
+                    only these vertices are computed
+            '''
+        self.seq_data = seq_data
+        self.model_pool = model_pool
+        self.grab_path = grab_path
+        self.chunk_size = chunk_size
+        self.vertex_subsets = vertex_subsets or {}
+        self.outputs = {}
+
+    def body_model(self):
+        seq_data = self.seq_data
+        sbj_mesh = os.path.join(self.grab_path, '..', seq_data.body.vtemp)
+        return self.model_pool.get('smplx', sbj_mesh,
+                                   gender=seq_data.gender,
+                                   n_comps=seq_data.n_comps)
+
+    def forward(self, part, model, params):
+        # the full forward, or only the vertices of the subset of the part
+        vertex_ids = subset_vertex_ids(self.vertex_subsets.get(part), model)
+        if vertex_ids is None:
+            model_fn = lambda p: self.model_pool.forward(model, p)
+        else:
+            model_fn = self.model_pool.sparse(model, vertex_ids)
+        output = forward_in_chunks(model_fn, params, self.chunk_size, outputs=['vertices', 'joints'])
+        output['vertex_ids'] = vertex_ids
+        return output
+
+    def body(self):
+        '''
+        the vertices and joints of the body, as numpy arrays, and the vertex_ids of the subset if any
+        '''
+        if 'body' not in self.outputs:
+            sbj_parms = params2torch(self.seq_data.body.params)
+            self.outputs['body'] = self.forward('body', self.body_model(), sbj_parms)
+        return self.outputs['body']
+
+    def hand_joints(self):
+        '''
+        the joints of the body and the vertices of the fingertips (RHAND_VERTEX_TIPS then LHAND_VERTEX_TIPS),
+        as numpy arrays. Unless the body vertices are already computed, only the kinematic chain
+        and the fingertip vertices are evaluated
+        '''
+        if 'hand_joints' not in self.outputs:
+            smplx_vertex_ids = smplx.vertex_ids.vertex_ids['smplx']
+            tip_ids = [smplx_vertex_ids[name] for name in tools.consts.RHAND_VERTEX_TIPS + tools.consts.LHAND_VERTEX_TIPS]
+            if 'body' in self.outputs and self.outputs['body']['vertex_ids'] is None:
+                output_sbj = self.outputs['body']
+                self.outputs['hand_joints'] = {'joints': output_sbj['joints'],
+                                               'tips': output_sbj['vertices'][:, tip_ids]}
+            else:
+                sbj_m = self.model_pool.sparse(self.body_model(), tip_ids)
+                sbj_parms = params2torch(self.seq_data.body.params)
+                output_sbj = forward_in_chunks(sbj_m, sbj_parms, self.chunk_size, outputs=['vertices', 'joints'])
+                self.outputs['hand_joints'] = {'joints': output_sbj['joints'], 'tips': output_sbj['vertices']}
+        return self.outputs['hand_joints']
+
+    def hand(self, data_name):
+        '''
+        the vertices and joints of the 'lhand' or 'rhand' model, as numpy arrays, and the vertex_ids of the subset if any
+        '''
+        if data_name not in self.outputs:
+            hand_data = self.seq_data[data_name]
+            hand_mesh = os.path.join(self.grab_path, '..', hand_data.vtemp)
+            hand_m = self.model_pool.get('mano', hand_mesh,
+                                         is_rhand=data_name == 'rhand',
+                                         n_comps=self.seq_data.n_comps)
+
+            hand_parms = params2torch(hand_data.params)
+            self.outputs[data_name] = self.forward(data_name, hand_m, hand_parms)
+        return self.outputs[data_name]
+
+    def object(self, n_verts_sample):
+        '''
+        the vertices of the object, at n_verts_sample randomly sampled vertices of its mesh
+        '''
+        if 'object' not in self.outputs:
+            seq_data = self.seq_data
+            chunk_size = self.chunk_size
+            obj_mesh = os.path.join(self.grab_path, '..', seq_data.object.object_mesh)
+            obj_vtemp = np.array(Mesh(filename=obj_mesh).vertices)
+            sample_id = np.random.choice(obj_vtemp.shape[0], n_verts_sample, replace=False)
+            obj_m = ObjectModel(v_template=obj_vtemp[sample_id])
+            obj_parms = params2torch(seq_data.object.params)
+            self.outputs['object'] = forward_in_chunks(lambda p: obj_m(**p),
+                                                       obj_parms, chunk_size)
+        return self.outputs['object']
+
+
+def subset_arrays(output):
+    '''
+    the vertex ids saved with the vertices of a subset
+    '''
+    return {} if output['vertex_ids'] is None else {'vertex_ids': output['vertex_ids']}
+
+
+def process_sequence(cfg, sequence, model_pool, out_path, vertex_subsets=None):
+    '''
+    compute and save the outputs of a single sequence
+    :param vertex_subsets: the vertex subset spec of each body part, with the contact ones resolved
+    :return: the log messages of the sequence
+    '''
+    messages = []
+    logger = messages.append
 
-        gc.collect()
+    grab_path = cfg.grab_path
+    # the models run on chunks of frames to bound the memory of long sequences
+    chunk_size = cfg.get('forward_chunk_size', 0)
 
-        outfname = makepath(sequence.replace(grab_path,out_path).replace('.npz', '_verts_body.npz'), isfile=True)
+    outfname = makepath(sequence.replace(grab_path,out_path).replace('.npz', '_verts_body.npz'), isfile=True)
 
-        action_name = os.path.basename(sequence)
-        #remove this
-        if os.path.exists(outfname.replace('_verts_body.npz', '_verts_object.npz')):
-            logger('Results for %s split already exist.' % (action_name))
-            #continue
-        else:
-            logger('Processing data for %s split.' % (action_name))
+    action_name = os.path.basename(sequence)
+    #remove this
+    if os.path.exists(outfname.replace('_verts_body.npz', '_verts_object.npz')):
+        logger('Results for %s split already exist.' % (action_name))
+        #continue
+    else:
+        logger('Processing data for %s split.' % (action_name))
 
-        seq_data = parse_npz(sequence)
-        n_comps = seq_data['n_comps']
-        gender = seq_data['gender']
+    # the entries are decoded only when an output needs them
+    seq_data = parse_npz(sequence, lazy=True)
 
-        T = seq_data.n_frames
+    T = seq_data.n_frames
 
-        # For when multiple configs use it
-        smplx_created = False
+    # each model runs once, on the first output that needs it
+    forwards = SequenceForwards(seq_data, model_pool, grab_path, chunk_size, vertex_subsets)
 
-        if cfg.save_metadata:
-            cur_outname = outfname.replace('_verts_body.npz', '_metadata.npz')
-            if os.path.exists(cur_outname) and not cfg.force_reprocess:
-                logger('Results for %s already exist.' % (cur_outname))
-            
-            else:
-                obj_name_out = np.array([seq_data.obj_name]*T)
-                sbj_id_out   = np.array([seq_data.sbj_id]*T)
-                n_comps_out  = np.array([seq_data.n_comps]*T)
-                gender_out   = np.array([seq_data.gender]*T)
-                intent_out = np.array([seq_data.motion_intent]*T)
-                frame_nums_out = np.arange(T)
-                np.savez_compressed(cur_outname, obj_name=obj_name_out, sbj_id=sbj_id_out, n_comps=n_comps_out, 
-                                    gender=gender_out, intent=intent_out, frame_nums=frame_nums_out)
-
-
-        if cfg.save_body_verts:
-            cur_outname = outfname
-            if os.path.exists(cur_outname) and not cfg.force_reprocess:
-                logger('Results for %s already exist.' % (cur_outname))
-            
-            else:
-                sbj_mesh = os.path.join(grab_path, '..', seq_data.body.vtemp)
-                sbj_vtemp = np.array(Mesh(filename=sbj_mesh).vertices)
-
-                sbj_m = smplx.create( model_path=cfg.model_path,
-                                    model_type='smplx',
-                                    gender=gender,
-                                    num_pca_comps=n_comps,
-                                    v_template = sbj_vtemp,
-                                    batch_size=T)
-
-                sbj_parms = params2torch(seq_data.body.params)
-                output_sbj = sbj_m(**sbj_parms, no_grad=True)
-                verts_sbj = to_cpu(output_sbj.vertices)
-                joints_sbj = to_cpu(output_sbj.joints) # to get the body joints (it includes some additional landmarks, check smplx repo.
-                np.savez_compressed(cur_outname, verts_body=verts_sbj)
+    if cfg.save_metadata:
+        cur_outname = outfname.replace('_verts_body.npz', '_metadata.npz')
+        if os.path.exists(cur_outname) and not cfg.force_reprocess:
+            logger('Results for %s already exist.' % (cur_outname))
         
-        if cfg.save_hand_joints:
-            cur_outname = outfname.replace('_verts_body.npz', '_hand_joints.npz')
-            if os.path.exists(cur_outname) and not cfg.force_reprocess:
-                logger('Results for %s already exist.' % (cur_outname))
-            
-            else:
-                if not smplx_created:
-                    sbj_mesh = os.path.join(grab_path, '..', seq_data.body.vtemp)
-                    sbj_vtemp = np.array(Mesh(filename=sbj_mesh).vertices)
-
-                    sbj_m = smplx.create( model_path=cfg.model_path,
-                                        model_type='smplx',
-                                        gender=gender,
-                                        num_pca_comps=n_comps,
-                                        v_template = sbj_vtemp,
-                                        batch_size=T)
-
-                    sbj_parms = params2torch(seq_data.body.params)
-                    output_sbj = sbj_m(**sbj_parms)
-                    verts_sbj = to_cpu(output_sbj.vertices)
-                    joints_sbj = to_cpu(output_sbj.joints) # to get the body joints (it includes some additional landmarks, check smplx repo.
-                    
-                lhand_parms = params2torch(seq_data.lhand.params)
-                rhand_parms = params2torch(seq_data.rhand.params)
-                joint_names = smplx.joint_names.JOINT_NAMES
-                rhand_joints = output_sbj.joints[:, [joint_names.index(name) for name in tools.consts.RHAND_JOINT_NAMES], :].detach().numpy()
-                lhand_joints = output_sbj.joints[:, [joint_names.index(name) for name in tools.consts.LHAND_JOINT_NAMES], :].detach().numpy()
-                smplx_vertex_ids = smplx.vertex_ids.vertex_ids['smplx']
-                rhand_tips = output_sbj.vertices[:,[smplx_vertex_ids[name] for name in tools.consts.RHAND_VERTEX_TIPS],:].detach().numpy()
-                lhand_tips = output_sbj.vertices[:,[smplx_vertex_ids[name] for name in tools.consts.LHAND_VERTEX_TIPS],:].detach().numpy()
-                #lhand_all = torch.cat((lhand_joints, lhand_tips), axis=1)
-                #rhand_all = torch.cat((rhand_joints, rhand_tips), axis=1)
-                lhand_transl = lhand_parms['transl'].detach().numpy()
-                rhand_transl = rhand_parms['transl'].detach().numpy()
-                
-                lhand_orient = -lhand_parms['global_orient']
-                rhand_orient = -rhand_parms['global_orient']
-                lhand_rot_mats = to_cpu(smplx.lbs.batch_rodrigues(lhand_orient.view(-1, 3)).view([np.shape(lhand_joints)[0], 3, 3]))
-                rhand_rot_mats = to_cpu(smplx.lbs.batch_rodrigues(lhand_orient.view(-1, 3)).view([np.shape(rhand_joints)[0], 3, 3]))
-                
-                        
-                np.savez_compressed(cur_outname, lhand_tips=lhand_tips, rhand_tips = rhand_tips, 
-                                    lhand_joints=lhand_joints, rhand_joints=rhand_joints,
-                                    lhand_trans = lhand_transl, rhand_trans=rhand_transl, 
-                                    lhand_rot = lhand_rot_mats, rhand_rot = rhand_rot_mats)
+        else:
+            obj_name_out = np.array([seq_data.obj_name]*T)
+            sbj_id_out   = np.array([seq_data.sbj_id]*T)
+            n_comps_out  = np.array([seq_data.n_comps]*T)
+            gender_out   = np.array([seq_data.gender]*T)
+            intent_out = np.array([seq_data.motion_intent]*T)
+            frame_nums_out = np.arange(T)
+            save_arrays(cur_outname, cfg, logger, obj_name=obj_name_out, sbj_id=sbj_id_out, n_comps=n_comps_out, 
+                                gender=gender_out, intent=intent_out, frame_nums=frame_nums_out)
+
+
+    if cfg.save_body_verts:
+        cur_outname = outfname
+        if os.path.exists(cur_outname) and not cfg.force_reprocess:
+            logger('Results for %s already exist.' % (cur_outname))
         
-        if cfg.save_contact:
-            cur_outname = outfname.replace('_verts_body.npz', '_contact_info.npz')
-            if os.path.exists(cur_outname) and not cfg.force_reprocess:
-                logger('Results for %s already exist.' % (cur_outname))
-            
-            else:
-                #object vertices, so need that
-                object_contact = seq_data['contact']['object']
-                body_contact = seq_data['contact']['body']
-                frame_mask = (seq_data['contact']['object']>0).any(axis=1)
-                np.savez_compressed(cur_outname, object_contact_mask = frame_mask,
-                                    object_contact = object_contact, body_contact = body_contact)
-
-        if cfg.save_lhand_verts:
-            cur_outname = outfname.replace('_verts_body.npz', '_verts_lhand.npz')
-            if os.path.exists(cur_outname) and not cfg.force_reprocess:
-                logger('Results for %s already exist.' % (cur_outname))
-            
-            else:
-                lh_mesh = os.path.join(grab_path, '..', seq_data.lhand.vtemp)
-                lh_vtemp = np.array(Mesh(filename=lh_mesh).vertices)
-
-                lh_m = smplx.create(model_path=cfg.model_path,
-                                    model_type='mano',
-                                    is_rhand=False,
-                                    v_template = lh_vtemp,
-                                    num_pca_comps=n_comps,
-                                    flat_hand_mean = True,
-                                    batch_size=T)
-
-                lh_parms = params2torch(seq_data.lhand.params)
-                lh_output = lh_m(**lh_parms)
-                verts_lh = to_cpu(lh_output.vertices)
-                joints_lh = to_cpu(lh_output.joints) # to get the hand joints          
-                np.savez_compressed(cur_outname, verts_body=verts_lh)
-
-        if cfg.save_rhand_verts:
-            cur_outname  = outfname.replace('_verts_body.npz', '_verts_rhand.npz')
-            if os.path.exists(cur_outname) and not cfg.force_reprocess:
-                logger('Results for %s already exist.' % (cur_outname))
+        else:
+            output_sbj = forwards.body()
+            save_arrays(cur_outname, cfg, logger, verts_body=output_sbj['vertices'],
+                        **subset_arrays(output_sbj))
+    
+    if cfg.save_hand_joints:
+        cur_outname = outfname.replace('_verts_body.npz', '_hand_joints.npz')
+        if os.path.exists(cur_outname) and not cfg.force_reprocess:
+            logger('Results for %s already exist.' % (cur_outname))
+        
+        else:
+            output_sbj = forwards.hand_joints()
+            joints_sbj = output_sbj['joints'] # the joints of the kinematic chain come first (check smplx repo.)
+
+            lhand_parms = params2torch(seq_data.lhand.params)
+            rhand_parms = params2torch(seq_data.rhand.params)
+            joint_names = smplx.joint_names.JOINT_NAMES
+            rhand_joints = joints_sbj[:, [joint_names.index(name) for name in tools.consts.RHAND_JOINT_NAMES], :]
+            lhand_joints = joints_sbj[:, [joint_names.index(name) for name in tools.consts.LHAND_JOINT_NAMES], :]
+            n_tips = len(tools.consts.RHAND_VERTEX_TIPS)
+            rhand_tips = output_sbj['tips'][:, :n_tips]
+            lhand_tips = output_sbj['tips'][:, n_tips:]
+            #lhand_all = torch.cat((lhand_joints, lhand_tips), axis=1)
+            #rhand_all = torch.cat((rhand_joints, rhand_tips), axis=1)
+            lhand_transl = lhand_parms['transl'].detach().numpy()
+            rhand_transl = rhand_parms['transl'].detach().numpy()
             
-            else:
-                rh_mesh = os.path.join(grab_path, '..', seq_data.rhand.vtemp)
-                rh_vtemp = np.array(Mesh(filename=rh_mesh).vertices)
-
-                rh_m = smplx.create(model_path=cfg.model_path,
-                                    model_type='mano',
-                                    is_rhand = True,
-                                    v_template = rh_vtemp,
-                                    num_pca_comps=n_comps,
-                                    flat_hand_mean=True,
-                                    batch_size=T)
-
-                rh_parms = params2torch(seq_data.rhand.params)
-                rh_output = rh_m(**rh_parms)
-                verts_rh = to_cpu(rh_output.vertices)
-                joints_rh = to_cpu(rh_output.joints) # to get the hand joints
-                np.savez_compressed(cur_outname, verts_body=verts_rh)
-
-
-        if cfg.save_object_verts:
-            cur_outname = outfname.replace('_verts_body.npz', '_verts_object.npz')
-            if os.path.exists(cur_outname) and not cfg.force_reprocess:
-                logger('Results for %s already exist.' % (cur_outname))
+            lhand_orient = -lhand_parms['global_orient']
+            rhand_orient = -rhand_parms['global_orient']
+            lhand_rot_mats = to_cpu(smplx.lbs.batch_rodrigues(lhand_orient.view(-1, 3)).view([np.shape(lhand_joints)[0], 3, 3]))
+            rhand_rot_mats = to_cpu(smplx.lbs.batch_rodrigues(rhand_orient.view(-1, 3)).view([np.shape(rhand_joints)[0], 3, 3]))
             
+                    
+            save_arrays(cur_outname, cfg, logger, lhand_tips=lhand_tips, rhand_tips = rhand_tips, 
+                                lhand_joints=lhand_joints, rhand_joints=rhand_joints,
+                                lhand_trans = lhand_transl, rhand_trans=rhand_transl, 
+                                lhand_rot = lhand_rot_mats, rhand_rot = rhand_rot_mats)
+    
+    if cfg.save_contact:
+        cur_outname = outfname.replace('_verts_body.npz', '_contact_info.npz')
+        if os.path.exists(cur_outname) and not cfg.force_reprocess:
+            logger('Results for %s already exist.' % (cur_outname))
+        
+        else:
+            #object vertices, so need that
+            object_contact = seq_data['contact']['object']
+            body_contact = seq_data['contact']['body']
+            frame_mask = (seq_data['contact']['object']>0).any(axis=1)
+            if cfg.get('contact_format', 'dense') == 'csr':
+                # only the contacting vertices of each frame, read them with SparseContact.from_arrays
+                contacts = dict(SparseContact.from_dense(object_contact).to_arrays('object_contact'),
+                                **SparseContact.from_dense(body_contact).to_arrays('body_contact'))
+                save_arrays(cur_outname, cfg, logger, object_contact_mask = frame_mask, **contacts)
             else:
-                obj_mesh = os.path.join(grab_path, '..', seq_data.object.object_mesh)
-                obj_vtemp = np.array(Mesh(filename=obj_mesh).vertices)
-                sample_id = np.random.choice(obj_vtemp.shape[0], cfg.n_verts_sample, replace=False)
-                obj_m = ObjectModel(v_template=obj_vtemp[sample_id],
-                                    batch_size=T)
-                obj_parms = params2torch(seq_data.object.params)
-                verts_obj = to_cpu(obj_m(**obj_parms).vertices)
-                np.savez_compressed(cur_outname, verts_object=verts_obj)
+                save_arrays(cur_outname, cfg, logger, object_contact_mask = frame_mask,
+                                object_contact = object_contact, body_contact = body_contact)
+
+    if cfg.save_lhand_verts:
+        cur_outname = outfname.replace('_verts_body.npz', '_verts_lhand.npz')
+        if os.path.exists(cur_outname) and not cfg.force_reprocess:
+            logger('Results for %s already exist.' % (cur_outname))
+        
+        else:
+            output_lh = forwards.hand('lhand')
+            save_arrays(cur_outname, cfg, logger, verts_body=output_lh['vertices'], **subset_arrays(output_lh))
+
+    if cfg.save_rhand_verts:
+        cur_outname  = outfname.replace('_verts_body.npz', '_verts_rhand.npz')
+        if os.path.exists(cur_outname) and not cfg.force_reprocess:
+            logger('Results for %s already exist.' % (cur_outname))
+        
+        else:
+            output_rh = forwards.hand('rhand')
+            save_arrays(cur_outname, cfg, logger, verts_body=output_rh['vertices'], **subset_arrays(output_rh))
 
 
+    if cfg.save_object_verts:
+        cur_outname = outfname.replace('_verts_body.npz', '_verts_object.npz')
+        if os.path.exists(cur_outname) and not cfg.force_reprocess:
+            logger('Results for %s already exist.' % (cur_outname))
+        
+        else:
+            verts_obj = forwards.object(cfg.n_verts_sample)['vertices']
+            save_arrays(cur_outname, cfg, logger, verts_object=verts_obj)
+
 
-        logger('Processing finished')
+
+    logger('Processing finished')
+    return messages
 
 
 if __name__ == '__main__':
@@ -297,6 +480,38 @@ if __name__ == '__main__':
             # number of vertices samples for each object
             'n_verts_sample': 1024,
 
+            # number of frames in each forward pass, 0 runs all the frames at once
+            'forward_chunk_size': 256,
+
+            # if True, lists the sequences from the sequence catalog instead of globbing
+            'use_catalog': False,
+
+            # number of worker processes for the sequences, 0 processes them serially
+            'num_workers': 0,
+
+            # storage codec of the vertices, joints and translations: None, 'float16' or 'int16',
+            # and of the contacts: None, 'uint8' or 'bitpack'
+            'quantize_verts': None,
+            'quantize_contact': None,
+
+            # file codec: 'npz' (zlib), 'npy' (uncompressed), or with their library installed 'zstd', 'lz4', 'blosc'
+            # (compressed by codec_threads threads). Either one codec or a dict with one per output, e.g. {'verts_body': 'lz4'}.
+            # Read the outputs with tools.arrayio.load_arrays
+            'output_codec': 'npz',
+            # 0 uses all the cpus, divided between the processes with num_workers > 1
+            'codec_threads': 0,
+
+            # 'dense' saves the contacts as T x V arrays, 'csr' only the vertices in contact in each frame
+            # and their labels (tools.contact.SparseContact.from_arrays(outputs, 'object_contact'))
+            'contact_format': 'dense',
+
+            # the vertices computed and saved for the body and the hands: None for all of them, a list of vertex ids,
+            # a region of tools.vertexsubsets.REGIONS for the body (e.g. 'hands'), or {'contact': 0.01} for the body
+            # vertices in contact in at least 1% of the frames. The ids are saved in the vertex_ids entry of the outputs
+            'body_vertex_ids': None,
+            'lhand_vertex_ids': None,
+            'rhand_vertex_ids': None,
+
             #IO path
             'grab_path': grab_path,
             'out_path': out_path,
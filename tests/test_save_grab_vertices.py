@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+# Run with a GRAB sequence and the smplx/mano models:
+#   GRAB_SEQUENCE=$GRAB_DATASET_PATH/s1/mug_eat_1.npz GRAB_MODEL_PATH=$SMPLX_MODEL_FOLDER python -m pytest tests
+#
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+import torch
+
+from grab.save_grab_vertices import process_sequence
+from tools.arrayio import load_arrays
+from tools.cfg_parser import Config
+from tools.modelpool import ModelPool
+from tools.utils import parse_npz
+from tools.utils import params2torch
+
+SEQUENCE = os.environ.get('GRAB_SEQUENCE')
+MODEL_PATH = os.environ.get('GRAB_MODEL_PATH')
+
+pytestmark = pytest.mark.skipif(SEQUENCE is None or MODEL_PATH is None,
+                                reason='set GRAB_SEQUENCE and GRAB_MODEL_PATH to a GRAB sequence and the models')
+
+
+@pytest.mark.parametrize('data_name', ['rhand', 'lhand'])
+def test_hand_rot_undoes_the_hand_orientation(tmp_path, data_name):
+    # the saved rotation of each hand brings the mano joints of the sequence, relative to the wrist,
+    # back to the joints of the same hand pose without global orientation
+    grab_path = os.path.dirname(os.path.dirname(SEQUENCE))
+    cfg = Config(grab_path=grab_path, model_path=MODEL_PATH, force_reprocess=True, n_verts_sample=512,
+                 save_hand_joints=True, save_body_verts=False, save_object_verts=False,
+                 save_lhand_verts=False, save_rhand_verts=False, save_contact=False, save_metadata=False)
+    model_pool = ModelPool(MODEL_PATH)
+    process_sequence(cfg, SEQUENCE, model_pool, str(tmp_path))
+
+    outfname = SEQUENCE.replace(grab_path, str(tmp_path)).replace('.npz', '_hand_joints.npz')
+    rot_mats = torch.from_numpy(load_arrays(outfname)['%s_rot' % data_name]).to(torch.float32)
+
+    seq_data = parse_npz(SEQUENCE)
+    hand_m = model_pool.get('mano', os.path.join(grab_path, '..', seq_data[data_name].vtemp),
+                            is_rhand=data_name == 'rhand', n_comps=seq_data.n_comps)
+    params = params2torch(seq_data[data_name].params)
+    joints = model_pool.forward(hand_m, params).joints
+    rest_params = dict(params, global_orient=torch.zeros_like(params['global_orient']),
+                       transl=torch.zeros_like(params['transl']))
+    rest_joints = model_pool.forward(hand_m, rest_params).joints
+
+    local_joints = torch.einsum('bij,bkj->bki', rot_mats, joints - joints[:, :1])
+    assert torch.allclose(local_joints, rest_joints - rest_joints[:, :1], atol=1e-4)
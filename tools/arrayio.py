@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import os
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.quantize import decode_arrays
+
+# the optional compression libraries, each codec is available only if its library is installed.
+# The compressors take the bytes and the size of the array elements
+COMPRESSORS = {}
+
+try:
+    import zstandard
+    COMPRESSORS['zstd'] = (lambda b, typesize: zstandard.ZstdCompressor(level=3).compress(b),
+                           lambda b: zstandard.ZstdDecompressor().decompress(b))
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+    COMPRESSORS['lz4'] = (lambda b, typesize: lz4.frame.compress(b), lz4.frame.decompress)
+except ImportError:
+    pass
+
+try:
+    import blosc
+    blosc.set_nthreads(1)
+    # byte shuffle and zstd, the bytes are shuffled by the element size of each array
+    COMPRESSORS['blosc'] = (lambda b, typesize: blosc.compress(b, typesize=typesize, cname='zstd', shuffle=blosc.SHUFFLE),
+                            blosc.decompress)
+except ImportError:
+    pass
+
+# 'npz': zip with zlib (np.savez_compressed), 'npy': zip of uncompressed .npy arrays (np.savez),
+# 'zstd', 'lz4', 'blosc': arrays compressed in chunks by several threads, stored in an uncompressed zip
+CODECS = ['npz', 'npy'] + list(COMPRESSORS)
+
+CHUNK_BYTES = 1 << 22
+
+
+def compress_array(array, codec, executor):
+    # the chunks are views of the array memory, not copies
+    data = memoryview(np.ascontiguousarray(array)).cast('B')
+    compress = COMPRESSORS[codec][0]
+    chunks = list(executor.map(lambda chunk: compress(chunk, array.itemsize),
+                               [data[i:i + CHUNK_BYTES] for i in range(0, len(data), CHUNK_BYTES)]))
+    meta = {'dtype': array.dtype.str, 'shape': list(array.shape), 'chunks': [len(c) for c in chunks]}
+    return np.frombuffer(b''.join(chunks), dtype=np.uint8), meta
+
+
+def decompress_array(data, meta, codec, executor):
+    decompress = COMPRESSORS[codec][1]
+    offsets = np.cumsum([0] + meta['chunks'])
+    data = memoryview(np.ascontiguousarray(data)).cast('B')
+    chunks = executor.map(decompress, [data[offsets[i]:offsets[i + 1]] for i in range(len(meta['chunks']))])
+    return np.frombuffer(b''.join(chunks), dtype=np.dtype(meta['dtype'])).reshape(meta['shape'])
+
+
+def save_arrays(outfname, arrays, codec='npz', n_threads=None):
+    '''
+    save a dict of arrays with a codec of CODECS, read them back with load_arrays
+    :param outfname: the output file, the zip container is written to it whatever its extension
+    :param n_threads: the number of compression threads, by default the number of cpus
+    '''
+    if codec == 'npz':
+        with open(outfname, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        return
+    if codec == 'npy':
+        with open(outfname, 'wb') as f:
+            np.savez(f, **arrays)
+        return
+    if codec not in COMPRESSORS:
+        raise ValueError('the %s codec is not available, install its library or use one of %s' % (codec, CODECS))
+
+    out, meta = {}, {}
+    with ThreadPoolExecutor(n_threads or os.cpu_count()) as executor:
+        for k, v in arrays.items():
+            v = np.asarray(v)
+            # the entries starting with _ (e.g. the quantization parameters) and object arrays are kept as they are
+            if k.startswith('_') or v.dtype.hasobject:
+                out[k] = v
+                continue
+            out[k], meta[k] = compress_array(v, codec, executor)
+    out['_arrayio'] = np.array(json.dumps({'codec': codec, 'arrays': meta}))
+    with open(outfname, 'wb') as f:
+        np.savez(f, **out)
+
+
+def load_arrays(fname, n_threads=None):
+    '''
+    read the arrays saved with save_arrays (any codec), or with np.savez,
+    and decode the arrays quantized with tools.quantize.encode_arrays
+    :return: dict of numpy arrays
+    '''
+    with np.load(fname, allow_pickle=True) as npz:
+        arrays = {k: npz[k] for k in npz.files}
+
+    if '_arrayio' in arrays:
+        info = json.loads(str(arrays.pop('_arrayio')))
+        if info['codec'] not in COMPRESSORS:
+            raise ValueError('%s needs the %s codec, install its library' % (fname, info['codec']))
+        with ThreadPoolExecutor(n_threads or os.cpu_count()) as executor:
+            for k, meta in info['arrays'].items():
+                arrays[k] = decompress_array(arrays[k], meta, info['codec'], executor)
+
+    return decode_arrays(arrays)
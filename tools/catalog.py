@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import os
+import glob
+import pathlib
+import sqlite3
+
+from tools.utils import parse_npz
+from tools.utils import makelogger
+
+CATALOG_COLUMNS = [
+    ('sequence', 'TEXT PRIMARY KEY'),
+    ('subject', 'TEXT'),
+    ('object', 'TEXT'),
+    ('action', 'TEXT'),
+    ('intent', 'TEXT'),
+    ('gender', 'TEXT'),
+    ('n_comps', 'INTEGER'),
+    ('n_frames', 'INTEGER'),
+    ('n_contact_frames', 'INTEGER'),
+    ('body_vtemp', 'TEXT'),
+    ('lhand_vtemp', 'TEXT'),
+    ('rhand_vtemp', 'TEXT'),
+    ('object_mesh', 'TEXT'),
+    ('table_mesh', 'TEXT'),
+    ('file_size', 'INTEGER'),
+    ('file_mtime', 'REAL'),
+]
+
+
+class SequenceCatalog(object):
+
+    def __init__(self, grab_path, catalog_path=None, logger=None):
+        ''' Persistent SQLite index of the GRAB sequences
+
+            The catalog is built once from the raw GRAB tree and holds the metadata of
+            every sequence, so the sequences can be listed and filtered without globbing
+            and loading each npz file. Sequences added, removed or modified since the last
+            build are detected from the file size and modification time and updated.
+
+                Parameters
+                ----------
+                grab_path: str
+                    The path to the grab folder of the dataset (containing s1, ..., s10)
+                catalog_path: str, optional
+                    The path to the catalog file, by default grab_catalog.sqlite next to grab_path
+                logger: optional
+                    The logging function, by default the log is written to grab_catalog.log next to the catalog
+
+            The catalog can be used in a with statement, which closes its database
+            '''
+
+        self.grab_path = grab_path
+        if catalog_path is None:
+            catalog_path = os.path.join(grab_path, '..', 'grab_catalog.sqlite')
+        self.catalog_path = catalog_path
+        if logger is None:
+            log_dir = os.path.splitext(self.catalog_path)[0] + '.log'
+            self.logger = makelogger(log_dir=log_dir, mode='a').info
+        else:
+            self.logger = logger
+
+        self.db = sqlite3.connect(self.catalog_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('CREATE TABLE IF NOT EXISTS sequences (%s)'
+                        % ', '.join('%s %s' % column for column in CATALOG_COLUMNS))
+        self.update()
+
+    def update(self):
+
+        all_seqs = glob.glob(self.grab_path + '/*/*.npz')
+        on_disk = {}
+        for sequence in all_seqs:
+            stat = os.stat(sequence)
+            on_disk[self.key(sequence)] = (stat.st_size, stat.st_mtime)
+
+        indexed = {row['sequence']: (row['file_size'], row['file_mtime'])
+                   for row in self.db.execute('SELECT sequence, file_size, file_mtime FROM sequences')}
+
+        removed = [key for key in indexed if key not in on_disk]
+        changed = [key for key, stat in on_disk.items() if indexed.get(key) != stat]
+
+        if removed:
+            self.db.executemany('DELETE FROM sequences WHERE sequence = ?', [(key,) for key in removed])
+        if changed:
+            self.logger('Indexing %d GRAB sequences in %s' % (len(changed), self.catalog_path))
+            rows = [self.index_sequence(key, on_disk[key]) for key in sorted(changed)]
+            self.db.executemany('INSERT OR REPLACE INTO sequences VALUES (%s)'
+                                % ', '.join(['?'] * len(CATALOG_COLUMNS)), rows)
+        self.db.commit()
+
+    def key(self, sequence):
+        return pathlib.PurePath(os.path.relpath(sequence, self.grab_path)).as_posix()
+
+    def path(self, key):
+        return os.path.join(self.grab_path, *key.split('/'))
+
+    def index_sequence(self, key, stat):
+
+        seq_data = parse_npz(self.path(key), lazy=True)
+        action = os.path.basename(key).split('.')[0]
+        n_contact_frames = (seq_data.contact.object > 0).any(axis=1).sum()
+
+        return (key,
+                str(seq_data.sbj_id),
+                str(seq_data.obj_name),
+                action,
+                str(seq_data.motion_intent),
+                str(seq_data.gender),
+                int(seq_data.n_comps),
+                int(seq_data.n_frames),
+                int(n_contact_frames),
+                str(seq_data.body.vtemp),
+                str(seq_data.lhand.vtemp),
+                str(seq_data.rhand.vtemp),
+                str(seq_data.object.object_mesh),
+                str(seq_data.table.table_mesh),
+                stat[0],
+                stat[1])
+
+    def query(self, subject=None, obj=None, intent=None, gender=None, action=None, min_contact_frames=None):
+        '''
+        filter the sequences of the catalog
+        :param subject: a subject id or a list of them, e.g. 's1'
+        :param obj: an object name or a list of them, e.g. 'mug'
+        :param intent: a motion intent or a list of them, e.g. 'lift'
+        :param gender: 'male' or 'female'
+        :param action: keep only sequences whose file name contains this string, e.g. 'eat'
+        :param min_contact_frames: keep only sequences with at least this many contact frames
+        :return: list of rows (sqlite3.Row), ordered by the sequence path
+        '''
+
+        conditions, values = [], []
+        for column, value in [('subject', subject), ('object', obj), ('intent', intent), ('gender', gender)]:
+            if value is None:
+                continue
+            value = [value] if isinstance(value, str) else list(value)
+            conditions.append('%s IN (%s)' % (column, ', '.join(['?'] * len(value))))
+            values += value
+        if action is not None:
+            conditions.append('action LIKE ?')
+            values.append('%%%s%%' % action)
+        if min_contact_frames is not None:
+            conditions.append('n_contact_frames >= ?')
+            values.append(int(min_contact_frames))
+
+        sql = 'SELECT * FROM sequences'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY sequence'
+        return self.db.execute(sql, values).fetchall()
+
+    def sequences(self, **filters):
+        '''
+        the paths of the sequences matching the filters of query
+        '''
+        return [self.path(row['sequence']) for row in self.query(**filters)]
+
+    def get(self, sequence):
+        '''
+        the catalog row of a sequence, given its path
+        '''
+        return self.db.execute('SELECT * FROM sequences WHERE sequence = ?', (self.key(sequence),)).fetchone()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import json
+import numpy as np
+
+# the arrays of a SparseContact saved as <name>_<field>, e.g. object_contact_indptr
+CSR_FIELDS = ['indptr', 'indices', 'labels', 'meta']
+
+
+class SparseContact(object):
+
+    def __init__(self, indptr, indices, labels, n_verts, dtype=np.int32):
+        ''' The contacts of a sequence or a split (T x V), as the vertices in contact in each frame
+
+            The contacting vertices of frame t are indices[indptr[t]:indptr[t + 1]], with their
+            contact labels (e.g. the body part of GRAB) in labels. Only the nonzero contacts are
+            stored, so most frames take a few bytes instead of V values.
+
+                Parameters
+                ----------
+                indptr: np.array T+1
+                    The start of the contacts of each frame
+                indices: np.array N
+                    The vertices in contact
+                labels: np.array N
+                    The contact label of each of them
+                n_verts: int
+                    The number of vertices, V
+                dtype: np.dtype
+                    The data type of the dense contacts
+            '''
+
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices)
+        self.labels = np.asarray(labels)
+        self.n_verts = int(n_verts)
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def from_dense(cls, contact):
+        '''
+        the sparse contacts of a dense T x V array
+        '''
+        contact = np.asarray(contact)
+        frames, indices = np.nonzero(contact)
+        labels = contact[frames, indices]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(frames, minlength=contact.shape[0]))])
+        return cls(indptr, indices.astype(index_dtype(contact.shape[1])), compact_labels(labels),
+                   contact.shape[1], contact.dtype)
+
+    @classmethod
+    def concatenate(cls, contacts):
+        '''
+        the contacts of several sequences one after the other, e.g. for a data split
+        '''
+        contacts = list(contacts)
+        n_verts = contacts[0].n_verts
+        assert all(c.n_verts == n_verts for c in contacts), 'the contacts must have the same vertices'
+        offsets = np.cumsum([0] + [c.indptr[-1] for c in contacts])
+        indptr = np.concatenate([[0]] + [c.indptr[1:] + offset for c, offset in zip(contacts, offsets)])
+        return cls(indptr,
+                   np.concatenate([c.indices for c in contacts]),
+                   compact_labels(np.concatenate([c.labels for c in contacts])),
+                   n_verts, contacts[0].dtype)
+
+    def to_arrays(self, name):
+        '''
+        the arrays to save the contacts in a npz file, as <name>_indptr, ...
+        '''
+        meta = {'n_verts': self.n_verts, 'dtype': self.dtype.str}
+        return {'%s_indptr' % name: self.indptr,
+                '%s_indices' % name: self.indices,
+                '%s_labels' % name: self.labels,
+                '%s_meta' % name: np.array(json.dumps(meta))}
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        '''
+        the contacts saved with to_arrays, from a loaded npz file or a dict of arrays
+        '''
+        meta = json.loads(str(arrays['%s_meta' % name]))
+        return cls(arrays['%s_indptr' % name], arrays['%s_indices' % name], arrays['%s_labels' % name],
+                   meta['n_verts'], meta['dtype'])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def shape(self):
+        return (len(self), self.n_verts)
+
+    def frames(self, frames=None):
+        # the frame indices of a slice, a list or an array of frames, all the frames by default
+        if frames is None:
+            return np.arange(len(self))
+        if isinstance(frames, slice):
+            return np.arange(len(self))[frames]
+        return np.asarray(frames)
+
+    def rows(self, start, end):
+        '''
+        the contacts of the frames start to end, e.g. of a single sequence of a split
+        '''
+        first, last = self.indptr[start], self.indptr[end]
+        return SparseContact(self.indptr[start:end + 1] - first, self.indices[first:last],
+                             self.labels[first:last], self.n_verts, self.dtype)
+
+    def frame_vertices(self, frame):
+        '''
+        the vertices in contact in a frame and their labels
+        '''
+        s = slice(self.indptr[frame], self.indptr[frame + 1])
+        return self.indices[s], self.labels[s]
+
+    def unpack(self, frames=None):
+        '''
+        the dense contacts of some frames
+        :param frames: a frame, a slice, or an array of frames of any shape, all the frames by default
+        :return: np.array of shape frames.shape + (V,)
+        '''
+        frames = self.frames(frames)
+        flat = frames.reshape(-1)
+        counts = self.indptr[flat + 1] - self.indptr[flat]
+        rows = np.repeat(np.arange(len(flat)), counts)
+        # the position of each contact of the selected frames in indices and labels
+        positions = np.arange(counts.sum()) + np.repeat(self.indptr[flat] - (np.cumsum(counts) - counts), counts)
+
+        out = np.zeros((len(flat), self.n_verts), dtype=self.dtype)
+        out[rows, self.indices[positions]] = self.labels[positions]
+        return out.reshape(frames.shape + (self.n_verts,))
+
+    def frame_ids(self):
+        # the frame of each stored contact
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def frames_in_contact(self, vertex_ids=None):
+        '''
+        whether each frame has a contact, on any vertex or only on vertex_ids
+        :return: boolean np.array T
+        '''
+        if vertex_ids is None:
+            return np.diff(self.indptr) > 0
+        selected = np.isin(self.indices, vertex_ids)
+        return np.bincount(self.frame_ids()[selected], minlength=len(self)) > 0
+
+    def contact_counts(self, frames=None):
+        '''
+        the number of frames each vertex is in contact, over all the frames or the given ones
+        :return: int np.array V
+        '''
+        if frames is None:
+            return np.bincount(self.indices, minlength=self.n_verts)
+        frames = self.frames(frames).reshape(-1)
+        selected = np.zeros(len(self), dtype=bool)
+        selected[frames] = True
+        return np.bincount(self.indices[selected[self.frame_ids()]], minlength=self.n_verts)
+
+    def vertices_touched(self, frames=None):
+        '''
+        whether each vertex is in contact in any frame, over all the frames or the given ones
+        :return: boolean np.array V
+        '''
+        return self.contact_counts(frames) > 0
+
+
+def index_dtype(n_verts):
+    return np.uint16 if n_verts <= np.iinfo(np.uint16).max + 1 else np.int32
+
+
+def compact_labels(labels):
+    # the GRAB contact labels are small integers, stored in a single byte when they fit
+    labels = np.asarray(labels)
+    if labels.size == 0 or (np.all(labels == np.round(labels)) and labels.min() >= 0 and labels.max() <= 255):
+        return labels.astype(np.uint8)
+    return labels
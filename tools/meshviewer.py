@@ -217,7 +217,11 @@ class MeshViewer(object):
         for node in self.scene.get_nodes():
             if node.name is None:
                 continue
-            if 'static' in set_type and 'mesh' in node.name:
+            if set_type == 'fixed' or 'fixed' in node.name:
+                # the fixed meshes are only replaced by set_fixed_meshes
+                if set_type == 'fixed' and 'fixed' in node.name:
+                    self.scene.remove_node(node)
+            elif 'static' in set_type and 'mesh' in node.name:
                 self.scene.remove_node(node)
             elif 'dynamic' in node.name:
                 self.scene.remove_node(node)
@@ -235,6 +239,13 @@ class MeshViewer(object):
     def set_dynamic_meshes(self, meshes =[]):
         self.set_meshes(meshes=meshes, set_type='dynamic')
 
+    def set_fixed_meshes(self, meshes =[]):
+        '''
+        set the meshes that do not change over the frames, e.g. a static table. They are uploaded once
+        and kept by set_static_meshes and set_dynamic_meshes, until the next call of set_fixed_meshes
+        '''
+        self.set_meshes(meshes=meshes, set_type='fixed')
+
     def save_snapshot(self, save_path):
         if not self.offscreen:
             print('We do not support rendering in Interactive mode!')
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import copy
+from collections import namedtuple
+import numpy as np
+import torch
+import smplx
+from smplx.lbs import batch_rodrigues, batch_rigid_transform
+
+from tools.meshviewer import Mesh
+
+# the parameters owned by the models, used when they are not given to the forward pass
+MODEL_PARAMS = ['betas', 'expression', 'body_pose', 'jaw_pose', 'leye_pose', 'reye_pose',
+                'left_hand_pose', 'right_hand_pose', 'hand_pose', 'transl']
+
+SparseOutput = namedtuple('SparseOutput', ['vertices', 'joints'])
+
+
+class ModelPool(object):
+
+    def __init__(self, model_path, dtype=torch.float32):
+        ''' Cache of SMPL-X and MANO models, shared across the sequences
+
+            The models are created once for each (model_type, gender, n_comps, is_rhand)
+            and reused with the template of each subject, so the model files are
+            read only once. All models are created with batch_size=1 and accept any
+            batch size through the forward method.
+
+                Parameters
+                ----------
+                model_path: str
+                    The path to the folder containing the smplx and mano models
+                dtype: torch.dtype
+                    The data type for the created variables
+            '''
+
+        self.model_path = model_path
+        self.dtype = dtype
+        self.base_models = {}
+        self.models = {}
+        self.sparse_models = {}
+
+    def get(self, model_type, vtemp_path, gender='neutral', n_comps=24, is_rhand=True, v_template=None):
+        ''' Returns the model of the given type with the subject template in vtemp_path
+
+                Parameters
+                ----------
+                model_type: str
+                    'smplx' or 'mano'
+                vtemp_path: str
+                    The path to the subject (or hand) template mesh, used as the cache key
+                v_template: np.array Vx3, optional
+                    The template vertices, if already loaded. Otherwise they are read from vtemp_path
+            '''
+
+        if model_type == 'mano':
+            gender = 'neutral'
+        else:
+            is_rhand = True
+
+        key = (model_type, gender, n_comps, is_rhand, vtemp_path)
+        if key not in self.models:
+
+            base_key = key[:-1]
+            if base_key not in self.base_models:
+                model_args = {'num_pca_comps': n_comps}
+                if model_type == 'mano':
+                    model_args.update({'is_rhand': is_rhand, 'flat_hand_mean': True})
+                else:
+                    model_args.update({'gender': gender})
+                self.base_models[base_key] = smplx.create(model_path=self.model_path,
+                                                          model_type=model_type,
+                                                          batch_size=1,
+                                                          dtype=self.dtype,
+                                                          **model_args)
+
+            if v_template is None:
+                v_template = np.array(Mesh(filename=vtemp_path).vertices)
+
+            # shallow copy, the subject models share all the buffers except the template
+            base = self.base_models[base_key]
+            model = copy.copy(base)
+            model._buffers = copy.copy(base._buffers)
+            model.v_template = torch.tensor(v_template, dtype=self.dtype)
+            self.models[key] = model
+
+        return self.models[key]
+
+    def sparse(self, model, vertex_ids=()):
+        ''' Returns the SparseLBS of a model returned by get, for the given vertices
+
+                Parameters
+                ----------
+                model: a model returned by get
+                vertex_ids: list of int
+                    The vertices to compute, none to get only the joints
+            '''
+
+        key = (id(model), tuple(int(i) for i in vertex_ids))
+        if key not in self.sparse_models:
+            self.sparse_models[key] = SparseLBS(model, vertex_ids)
+        return self.sparse_models[key]
+
+    def forward(self, model, params):
+        ''' Runs the model for a batch of any size
+
+                Parameters
+                ----------
+                model: a model returned by get
+                params: dict of torch.tensor, each of shape BxN
+            '''
+
+        batch_size = params['global_orient'].shape[0]
+        # smplx repeats the landmark buffers by the batch size of the model
+        model.batch_size = batch_size
+
+        inputs = dict(params)
+        for k in MODEL_PARAMS:
+            if k not in inputs and isinstance(getattr(model, k, None), torch.Tensor):
+                inputs[k] = getattr(model, k).expand(batch_size, -1)
+
+        with torch.no_grad():
+            return model(**inputs)
+
+
+class SparseLBS(object):
+
+    def __init__(self, model, vertex_ids=()):
+        ''' Linear blend skinning of a subset of the vertices of a SMPL-X or MANO model
+
+            The joints only depend on the shape through J_regressor, which is applied once
+            to the template and the shape directions. The forward pass then runs the kinematic
+            chain and skins only the selected rows of the template, shape directions, pose
+            directions and skinning weights, instead of the whole mesh.
+
+                Parameters
+                ----------
+                model: a model returned by ModelPool.get, with the subject template
+                vertex_ids: list of int
+                    The vertices to compute, possibly none to get only the joints
+            '''
+
+        self.model = model
+        self.is_smplx = hasattr(model, 'expr_dirs')
+
+        shapedirs = model.shapedirs
+        if self.is_smplx:
+            shapedirs = torch.cat([shapedirs, model.expr_dirs], dim=-1)
+
+        # the joints of the shaped template, Jx3 and Jx3xS
+        self.J_template = torch.matmul(model.J_regressor, model.v_template)
+        self.J_shapedirs = torch.einsum('jv,vcs->jcs', model.J_regressor, shapedirs)
+
+        ids = torch.as_tensor(vertex_ids, dtype=torch.long)
+        n_poses = model.posedirs.shape[0]
+        self.vertex_ids = ids
+        self.v_template = model.v_template[ids]
+        self.shapedirs = shapedirs[ids]
+        self.posedirs = model.posedirs.view(n_poses, -1, 3)[:, ids].reshape(n_poses, -1)
+        self.lbs_weights = model.lbs_weights[ids]
+
+    def full_pose(self, inputs):
+        # the same pose vector as the forward of smplx
+        model = self.model
+        if self.is_smplx:
+            left_hand_pose, right_hand_pose = inputs['left_hand_pose'], inputs['right_hand_pose']
+            if model.use_pca:
+                left_hand_pose = torch.einsum('bi,ij->bj', [left_hand_pose, model.left_hand_components])
+                right_hand_pose = torch.einsum('bi,ij->bj', [right_hand_pose, model.right_hand_components])
+            poses = [inputs['global_orient'], inputs['body_pose'], inputs['jaw_pose'],
+                     inputs['leye_pose'], inputs['reye_pose'], left_hand_pose, right_hand_pose]
+        else:
+            hand_pose = inputs['hand_pose']
+            if model.use_pca:
+                hand_pose = torch.einsum('bi,ij->bj', [hand_pose, model.hand_components])
+            poses = [inputs['global_orient'], hand_pose]
+
+        batch_size = inputs['global_orient'].shape[0]
+        return torch.cat([p.reshape(batch_size, -1) for p in poses], dim=1) + model.pose_mean
+
+    def forward(self, params):
+        ''' Runs the kinematic chain and skins the selected vertices, for a batch of any size
+
+                Parameters
+                ----------
+                params: dict of torch.tensor, each of shape BxN
+
+                Returns
+                -------
+                SparseOutput with the vertices (BxNx3, in the order of vertex_ids)
+                and the joints of the kinematic chain (BxJx3)
+            '''
+
+        model = self.model
+        batch_size = params['global_orient'].shape[0]
+
+        inputs = dict(params)
+        for k in MODEL_PARAMS:
+            if k not in inputs and isinstance(getattr(model, k, None), torch.Tensor):
+                inputs[k] = getattr(model, k).expand(batch_size, -1)
+
+        with torch.no_grad():
+            shape = inputs['betas'].expand(batch_size, -1)
+            if self.is_smplx:
+                shape = torch.cat([shape, inputs['expression']], dim=-1)
+
+            J = self.J_template + torch.einsum('bs,jcs->bjc', shape, self.J_shapedirs)
+            v_shaped = self.v_template + torch.einsum('bs,vcs->bvc', shape, self.shapedirs)
+
+            full_pose = self.full_pose(inputs)
+            rot_mats = batch_rodrigues(full_pose.view(-1, 3)).view(batch_size, -1, 3, 3)
+            ident = torch.eye(3, dtype=rot_mats.dtype, device=rot_mats.device)
+            pose_feature = (rot_mats[:, 1:] - ident).view(batch_size, -1)
+            v_posed = v_shaped + torch.matmul(pose_feature, self.posedirs).view(batch_size, -1, 3)
+
+            joints, A = batch_rigid_transform(rot_mats, J, model.parents, dtype=rot_mats.dtype)
+
+            T = torch.matmul(self.lbs_weights, A.view(batch_size, -1, 16)).view(batch_size, -1, 4, 4)
+            vertices = torch.matmul(T[:, :, :3, :3], v_posed.unsqueeze(-1))[..., 0] + T[:, :, :3, 3]
+
+            transl = inputs.get('transl')
+            if transl is not None:
+                joints = joints + transl.unsqueeze(dim=1)
+                vertices = vertices + transl.unsqueeze(dim=1)
+
+        return SparseOutput(vertices=vertices, joints=joints)
+
+    __call__ = forward
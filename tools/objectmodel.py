@@ -20,7 +20,23 @@ import torch.nn as nn
 from smplx.lbs import batch_rodrigues
 from collections import namedtuple
 
-model_output = namedtuple('output', ['vertices', 'global_orient', 'transl'])
+from tools.utils import to_cpu
+from tools.utils import forward_in_chunks
+
+model_output = namedtuple('output', ['vertices', 'global_orient', 'transl', 'rot_mats'], defaults=[None])
+
+def is_static(params, atol=1e-4):
+    '''
+    whether the pose of a rigid object is constant over the frames, e.g. for the table
+    :param params: dict with the global_orient and transl (Tx3) of the frames, numpy or torch
+    :param atol: the largest difference of the pose of any frame to the first one
+    '''
+    for k in ['global_orient', 'transl']:
+        track = params[k]
+        if len(track) and float(abs(track - track[:1]).max()) > atol:
+            return False
+    return True
+
 
 class ObjectModel(nn.Module):
 
@@ -33,9 +49,10 @@ class ObjectModel(nn.Module):
                 Parameters
                 ----------
                 v_template: np.array Vx3, dtype = np.float32
-                    The vertices of the object
+                    The vertices of the object, stored once and broadcast to the batch in forward
                 batch_size: int, N, optional
-                    The batch size used for creating the model variables
+                    The batch size of the default global_orient and transl. The forward pass
+                    accepts any batch size when they are given
 
                 dtype: torch.dtype
                     The data type for the created variables
@@ -47,7 +64,6 @@ class ObjectModel(nn.Module):
         self.dtype = dtype
 
         # Mean template vertices
-        v_template = np.repeat(v_template[np.newaxis], batch_size, axis=0)
         self.register_buffer('v_template', torch.tensor(v_template, dtype=dtype))
 
         transl = torch.tensor(np.zeros((batch_size, 3)), dtype=dtype, requires_grad=True)
@@ -59,7 +75,7 @@ class ObjectModel(nn.Module):
         self.batch_size = batch_size
 
 
-    def forward(self, global_orient=None, transl=None, v_template=None, **kwargs):
+    def forward(self, global_orient=None, transl=None, v_template=None, return_rot_mats=False, **kwargs):
 
         ''' Forward pass for the object model
 
@@ -75,8 +91,11 @@ class ObjectModel(nn.Module):
                 instead. For example, it can used if the translation
                 `transl` is predicted from some external model.
                 (default=None)
-            v_template: torch.tensor, optional, shape BxVx3
+            v_template: torch.tensor, optional, shape Vx3 or BxVx3
                 The new object vertices to overwrite the default vertices
+            return_rot_mats: bool, optional
+                If True, the rotation matrices (Bx3x3) are returned in the output,
+                e.g. to transform other points of the object. (default=False)
 
         Returns
             -------
@@ -92,13 +111,130 @@ class ObjectModel(nn.Module):
         if v_template is None:
             v_template = self.v_template
 
-        rot_mats = batch_rodrigues(global_orient.view(-1, 3)).view([self.batch_size, 3, 3])
+        rot_mats = batch_rodrigues(global_orient.view(-1, 3)).view([global_orient.shape[0], 3, 3])
 
+        # a Vx3 template is broadcast to all the frames of the batch
         vertices = torch.matmul(v_template, rot_mats) + transl.unsqueeze(dim=1)
 
         output = model_output(vertices=vertices,
                               global_orient=global_orient,
-                              transl=transl)
+                              transl=transl,
+                              rot_mats=rot_mats if return_rot_mats else None)
 
         return output
 
+    def forward_track(self, params, chunk_size=0, static_atol=1e-4):
+
+        ''' The vertices of the object for the poses of a sequence, as numpy arrays
+
+            If the pose is constant (up to static_atol, see is_static) the mesh is transformed
+            only once, for the first frame, and can be reused for all the frames.
+
+        Parameters
+            ----------
+            params: dict of torch.tensor
+                The global_orient and transl of each frame (Tx3)
+            chunk_size: int
+                The number of frames in each forward pass, 0 runs all the frames at once
+            static_atol: float or None
+                The tolerance of the static detection, None always transforms all the frames
+
+        Returns
+            -------
+                vertices: np.array TxVx3, or Vx3 for a static object
+                static: bool
+        '''
+
+        if static_atol is not None and is_static(params, static_atol):
+            with torch.no_grad():
+                vertices = self(**{k: v[:1] for k, v in params.items()}).vertices[0]
+            return to_cpu(vertices), True
+        with torch.no_grad():
+            return forward_in_chunks(lambda p: self(**p), params, chunk_size)['vertices'], False
+
+
+bank_output = namedtuple('bank_output', ['vertices', 'counts', 'rot_mats'])
+
+class ObjectBank(nn.Module):
+
+    def __init__(self,
+                 v_templates,
+                 dtype=torch.float32):
+        ''' Rigid transforms of several objects in a single vectorized call
+
+            The templates of all the objects are concatenated once, with the offset and the
+            number of vertices of each object, so a batch of frames of different objects is
+            transformed at once from the object id of each frame.
+
+                Parameters
+                ----------
+                v_templates: list of np.array V_ix3, or dict of them by object name
+                    The vertices of each object
+                dtype: torch.dtype
+                    The data type for the created variables
+            '''
+
+        super(ObjectBank, self).__init__()
+
+        self.dtype = dtype
+        if isinstance(v_templates, dict):
+            self.names = list(v_templates)
+            v_templates = list(v_templates.values())
+        else:
+            self.names = list(range(len(v_templates)))
+
+        counts = np.array([len(v) for v in v_templates], dtype=np.int64)
+        self.register_buffer('v_templates', torch.tensor(np.concatenate(v_templates, axis=0), dtype=dtype))
+        self.register_buffer('counts', torch.from_numpy(counts))
+        self.register_buffer('offsets', torch.from_numpy(np.cumsum(counts) - counts))
+        self.max_verts = int(counts.max()) if len(counts) else 0
+
+    def object_ids(self, names):
+        '''
+        the ids of the objects in the bank, given their names
+        '''
+        return torch.tensor([self.names.index(name) for name in names], dtype=torch.long)
+
+    def forward(self, object_ids, global_orient, transl, ragged=False, return_rot_mats=False):
+
+        ''' Forward pass for a batch of frames of any of the objects
+
+        Parameters
+            ----------
+            object_ids: torch.tensor, shape B
+                The object of each frame, as its index in the bank
+            global_orient: torch.tensor, shape Bx3
+            transl: torch.tensor, shape Bx3
+            ragged: bool, optional
+                If False, the vertices are padded with zeros to the largest object (BxV_maxx3).
+                If True, the vertices of all the frames are concatenated (sum(counts)x3). (default=False)
+            return_rot_mats: bool, optional
+                If True, the rotation matrices (Bx3x3) are returned in the output. (default=False)
+
+        Returns
+            -------
+                output: bank_output
+                The vertices and the number of vertices of each frame (counts)
+        '''
+
+        object_ids = torch.as_tensor(object_ids, dtype=torch.long, device=self.v_templates.device)
+        batch_size = object_ids.shape[0]
+        rot_mats = batch_rodrigues(global_orient.view(-1, 3)).view([batch_size, 3, 3])
+        counts = self.counts[object_ids]
+        offsets = self.offsets[object_ids]
+
+        if ragged:
+            frames = torch.repeat_interleave(torch.arange(batch_size, device=counts.device), counts)
+            local = torch.arange(frames.shape[0], device=counts.device) - (torch.cumsum(counts, 0) - counts)[frames]
+            v_template = self.v_templates[offsets[frames] + local]
+            vertices = torch.matmul(v_template.unsqueeze(1), rot_mats[frames]).squeeze(1) + transl[frames]
+        else:
+            local = torch.arange(self.max_verts, device=counts.device)
+            mask = local < counts.unsqueeze(1)
+            index = (offsets.unsqueeze(1) + local).clamp(max=max(self.v_templates.shape[0] - 1, 0))
+            vertices = torch.matmul(self.v_templates[index], rot_mats) + transl.unsqueeze(dim=1)
+            vertices = vertices * mask.unsqueeze(-1)
+
+        return bank_output(vertices=vertices,
+                           counts=counts,
+                           rot_mats=rot_mats if return_rot_mats else None)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import json
+import numpy as np
+import torch
+
+from tools.contact import CSR_FIELDS
+
+# 'float16' and 'int16' for the vertices, joints and translations, 'uint8' and 'bitpack' for the contacts.
+# 'bitpack' only keeps whether each vertex is in contact, not the contact labels
+VERTS_CODECS = ['float16', 'int16']
+CONTACT_CODECS = ['uint8', 'bitpack']
+
+INT16_MAX = 32767
+
+
+def select_codec(name, verts_codec=None, contact_codec=None):
+    '''
+    the codec of an output field, given its name
+    :param name: the field name, e.g. 'verts', 'transl', 'verts_body', 'object_contact'
+    :return: the codec name, or None to store the field as it is
+    '''
+    if 'contact' in name:
+        # the contact masks and the arrays of the sparse contacts are stored as they are
+        if name.endswith('mask') or name.split('_')[-1] in CSR_FIELDS:
+            return None
+        return contact_codec
+    if any(s in name for s in ['verts', 'trans', 'tips', 'joints']):
+        return verts_codec
+    return None
+
+
+def chunks(n, chunk_size=4096):
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
+
+
+def quant_params(array, codec):
+    '''
+    compute the parameters of a codec for an array, in chunks of frames so it can be memory-mapped
+    :return: dict with the codec, the original dtype and shape and the quantization parameters
+    '''
+    assert codec in VERTS_CODECS + CONTACT_CODECS
+
+    meta = {'codec': codec, 'dtype': array.dtype.name, 'shape': list(array.shape[1:])}
+    if codec == 'int16':
+        vmin, vmax = np.inf, -np.inf
+        for s in chunks(len(array)):
+            vmin = min(vmin, float(array[s].min()))
+            vmax = max(vmax, float(array[s].max()))
+        if not np.isfinite(vmin):
+            vmin = vmax = 0.
+        # one scale and offset per field
+        meta['offset'] = (vmax + vmin) / 2.
+        meta['scale'] = (vmax - vmin) / (2. * INT16_MAX) or 1.
+    elif codec == 'uint8':
+        for s in chunks(len(array)):
+            if len(array[s]) and (array[s].min() < 0 or array[s].max() > 255):
+                raise ValueError('the values do not fit in uint8, use the bitpack codec')
+    return meta
+
+
+def encoded_shape(meta):
+    if meta['codec'] == 'bitpack':
+        return meta['shape'][:-1] + [(meta['shape'][-1] + 7) // 8]
+    return meta['shape']
+
+
+def encoded_dtype(meta):
+    return {'float16': np.float16, 'int16': np.int16, 'uint8': np.uint8, 'bitpack': np.uint8}[meta['codec']]
+
+
+def encode(array, meta):
+    '''
+    encode an array (numpy) with the parameters of quant_params
+    '''
+    codec = meta['codec']
+    if codec == 'float16':
+        return array.astype(np.float16)
+    if codec == 'int16':
+        q = np.round((array - meta['offset']) / meta['scale'])
+        return np.clip(q, -INT16_MAX, INT16_MAX).astype(np.int16)
+    if codec == 'uint8':
+        return array.astype(np.uint8)
+    return np.packbits(array > 0, axis=-1)
+
+
+def decode(array, meta):
+    '''
+    decode an encoded array, numpy or torch, to the original dtype
+    '''
+    codec = meta['codec']
+    if torch.is_tensor(array):
+        dtype = getattr(torch, meta['dtype'])
+        if codec == 'int16':
+            return array.to(dtype) * meta['scale'] + meta['offset']
+        if codec == 'bitpack':
+            shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=array.device)
+            bits = (array.unsqueeze(-1) >> shifts) & 1
+            return bits.reshape(array.shape[:-1] + (-1,))[..., :meta['shape'][-1]].to(dtype)
+        return array.to(dtype)
+
+    dtype = np.dtype(meta['dtype'])
+    if codec == 'int16':
+        return (array.astype(np.float64) * meta['scale'] + meta['offset']).astype(dtype)
+    if codec == 'bitpack':
+        return np.unpackbits(array, axis=-1, count=meta['shape'][-1]).astype(dtype)
+    return array.astype(dtype)
+
+
+def encode_array(array, meta, out=None):
+    '''
+    encode an array in chunks of frames and measure the largest error of the decoded values
+    :param meta: the codec parameters of quant_params
+    :param out: an array to write the encoded values to, e.g. a memory-mapped file
+    :return: the encoded array and the codec parameters, with the error in meta['max_error']
+    '''
+    codec = meta['codec']
+    if out is None:
+        out = np.empty((len(array),) + tuple(encoded_shape(meta)), dtype=encoded_dtype(meta))
+
+    max_error = 0.
+    for s in chunks(len(array)):
+        out[s] = encode(array[s], meta)
+        reference = (array[s] > 0) if codec == 'bitpack' else array[s]
+        error = np.abs(decode(out[s], meta).astype(np.float64) - reference)
+        if error.size:
+            max_error = max(max_error, float(error.max()))
+    meta['max_error'] = max_error
+    return out, meta
+
+
+def encode_arrays(arrays, verts_codec=None, contact_codec=None):
+    '''
+    encode the arrays of a npz output with the codecs of select_codec. The codec parameters
+    are added as a json string in the '_codecs' entry, which is read by decode_arrays
+    :return: the arrays to save and the codec parameters of the encoded ones
+    '''
+    out, codecs = {}, {}
+    for name, array in arrays.items():
+        codec = select_codec(name, verts_codec, contact_codec)
+        if codec is None:
+            out[name] = array
+            continue
+        array = np.asarray(array)
+        out[name], codecs[name] = encode_array(array, quant_params(array, codec))
+    if codecs:
+        out['_codecs'] = np.array(json.dumps(codecs))
+    return out, codecs
+
+
+def decode_arrays(npz):
+    '''
+    read the arrays of a npz output saved with encode_arrays
+    :param npz: the path to the npz file, the loaded npz or a dict of arrays
+    :return: dict with the decoded arrays
+    '''
+    if isinstance(npz, str):
+        npz = np.load(npz)
+    names = npz.files if hasattr(npz, 'files') else list(npz)
+    codecs = json.loads(str(npz['_codecs'])) if '_codecs' in names else {}
+    return {k: decode(npz[k], codecs[k]) if k in codecs else npz[k] for k in names if k != '_codecs'}
@@ -16,13 +16,25 @@
 import numpy as np
 import torch
 import logging
+import hashlib
+import json
+import multiprocessing
+import contextlib
 from copy import copy
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 to_cpu = lambda tensor: tensor.detach().cpu().numpy()
 
-def parse_npz(npz, allow_pickle=True):
+def parse_npz(npz, allow_pickle=True, lazy=False, memoize=True):
+    '''
+    load a GRAB sequence as a dotdict
+    :param npz: path to the npz file
+    :param lazy: if True, each top-level entry (e.g. contact, body) is only decoded on its first access
+    :param memoize: if lazy, keep the decoded entries instead of decoding them again on each access
+    '''
     npz = np.load(npz, allow_pickle=allow_pickle)
+    if lazy:
+        return lazydotdict(npz, memoize=memoize)
     npz = {k: npz[k].item() for k in npz.files}
     return DotDict(npz)
 
@@ -32,6 +44,44 @@ def params2torch(params, dtype = torch.float32):
 def prepare_params(params, frame_mask, dtype = np.float32):
     return {k: v[frame_mask].astype(dtype) for k, v in params.items()}
 
+def frame_runs(frame_mask):
+    '''
+    find the runs of consecutive selected frames of a sequence
+    :param frame_mask: boolean array with the selected frames
+    :return: int array Rx2 with the first frame (in the sequence) and the length of each run
+    '''
+    frames = np.flatnonzero(frame_mask)
+    if len(frames) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(frames) != 1) + 1])
+    lengths = np.diff(np.concatenate([starts, [len(frames)]]))
+    return np.stack([frames[starts], lengths], axis=1)
+
+def forward_in_chunks(model_fn, params, chunk_size=None, outputs=['vertices'], out=None):
+    '''
+    run a model on fixed-size chunks of frames and stream the outputs to numpy arrays
+    :param model_fn: a function taking the params of a chunk and returning the model output
+    :param params: dict of torch tensors, with the frames in the first dimension
+    :param chunk_size: the number of frames in each forward pass, None or 0 for all the frames at once
+    :param outputs: the names of the model outputs to keep
+    :param out: dict of preallocated arrays to write the outputs to, e.g. memory-mapped slices
+    :return: dict of numpy arrays with the requested outputs
+    '''
+    T = next(iter(params.values())).shape[0]
+    if not chunk_size:
+        chunk_size = max(T, 1)
+
+    out = {} if out is None else out
+    for start in range(0, T, chunk_size):
+        chunk = {k: v[start:start + chunk_size] for k, v in params.items()}
+        output = model_fn(chunk)
+        for name in outputs:
+            value = to_cpu(getattr(output, name))
+            if name not in out:
+                out[name] = np.empty((T,) + value.shape[1:], dtype=value.dtype)
+            out[name][start:start + value.shape[0]] = value
+    return out
+
 def DotDict(in_dict):
 
     out_dict = copy(in_dict)
@@ -46,6 +96,54 @@ class dotdict(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
+class lazydotdict(dotdict):
+    """dotdict of an npz archive, decoding the top-level entries on their first access"""
+
+    def __init__(self, npz, memoize=True):
+        super(lazydotdict, self).__init__()
+        object.__setattr__(self, '_npz', npz)
+        object.__setattr__(self, '_memoize', memoize)
+
+    def _decode(self, k):
+        v = self._npz[k].item()
+        return DotDict(v) if isinstance(v, dict) else v
+
+    def __getitem__(self, k):
+        if dict.__contains__(self, k):
+            return dict.__getitem__(self, k)
+        if k not in self._npz.files:
+            raise KeyError(k)
+        v = self._decode(k)
+        if self._memoize:
+            dict.__setitem__(self, k, v)
+        return v
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    __getattr__ = get
+
+    def __contains__(self, k):
+        return dict.__contains__(self, k) or k in self._npz.files
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        return list(dict.fromkeys(self._npz.files + list(dict.keys(self))))
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
 
 def append2dict(source, data):
     for k in data.keys():
@@ -83,6 +181,45 @@ def to_np(array, dtype=np.float32):
         array = array.detach().cpu().numpy()
     return array
 
+def hash_file(path, block_size=1 << 20):
+    '''
+    compute the sha1 hash of a file's content
+    :param path: path to the file
+    :return: the hex digest of the hash
+    '''
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def config_hash(cfg, keys):
+    '''
+    compute the sha1 hash of some config entries, to find the outputs of a run with a different config
+    :param cfg: the config
+    :param keys: the config entries that change the outputs
+    :return: the hex digest of the hash
+    '''
+    cfg = {k: cfg.get(k) for k in keys}
+    return hashlib.sha1(json.dumps(cfg, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _init_pool_worker(initializer, initargs):
+    # one thread per worker, the pool itself provides the parallelism
+    torch.set_num_threads(1)
+    if initializer is not None:
+        initializer(*initargs)
+
+def worker_pool(num_workers, initializer=None, initargs=()):
+    '''
+    the process pool of the sequences, to use as `with worker_pool(...) as pool:`.
+    The workers are terminated when leaving the block, also if a sequence raises
+    :param num_workers: number of worker processes, with 0 the pool is None and the sequences are processed serially
+    :param initializer: function called with initargs in each worker process
+    '''
+    if num_workers > 0:
+        return multiprocessing.Pool(num_workers, initializer=_init_pool_worker, initargs=(initializer, initargs))
+    return contextlib.nullcontext()
+
 def makepath(desired_path, isfile = False):
     '''
     if the path does not exist make it
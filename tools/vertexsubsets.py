@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import numpy as np
+import torch
+import smplx.joint_names
+
+from tools.utils import parse_npz
+import tools.consts
+
+# the named regions of the smplx body, as the joints that mostly drive their vertices
+REGIONS = {
+    'rhand': tools.consts.RHAND_JOINT_NAMES,
+    'lhand': tools.consts.LHAND_JOINT_NAMES,
+    'hands': tools.consts.RHAND_JOINT_NAMES + tools.consts.LHAND_JOINT_NAMES,
+    'rarm': ['right_elbow', 'right_wrist'] + tools.consts.RHAND_JOINT_NAMES[1:],
+    'larm': ['left_elbow', 'left_wrist'] + tools.consts.LHAND_JOINT_NAMES[1:],
+    'head': ['neck', 'head', 'jaw', 'left_eye_smplhf', 'right_eye_smplhf'],
+}
+
+# the body parts whose vertex subsets can be set, e.g. with cfg['body_vertex_ids']
+SUBSET_PARTS = ['body', 'lhand', 'rhand']
+
+
+def region_vertex_ids(model, region):
+    '''
+    the vertices of a named region of REGIONS, whose largest skinning weight is on one of its joints
+    :param model: a smplx model, e.g. from ModelPool.get
+    '''
+    if not hasattr(model, 'expr_dirs'):
+        raise ValueError('the named regions are defined for the smplx body, use a list of vertices for the hands')
+    joint_names = smplx.joint_names.JOINT_NAMES
+    joint_ids = torch.tensor([joint_names.index(name) for name in REGIONS[region]])
+    dominant = model.lbs_weights.argmax(dim=1)
+    return np.nonzero(np.isin(dominant.numpy(), joint_ids.numpy()))[0]
+
+
+def contact_vertex_ids(sequences, threshold, logger=None):
+    '''
+    the body vertices in contact in at least a fraction threshold of the frames of the sequences.
+    Only the body contacts of each sequence are read
+    '''
+    counts, n_frames = None, 0
+    for sequence in sequences:
+        contact = parse_npz(sequence, lazy=True).contact.body
+        in_contact = (contact > 0).sum(axis=0)
+        counts = in_contact if counts is None else counts + in_contact
+        n_frames += contact.shape[0]
+    if counts is None:
+        return np.zeros(0, dtype=np.int64)
+    vertex_ids = np.nonzero(counts >= threshold * max(n_frames, 1))[0]
+    if logger is not None:
+        logger('%d body vertices are in contact in at least %g of the %d frames'
+               % (len(vertex_ids), threshold, n_frames))
+    return vertex_ids
+
+
+def resolve_contact_subsets(specs, sequences, logger=None):
+    '''
+    replace the contact-frequency specs ({'contact': threshold}) by their vertex ids, computed over the sequences
+    :param specs: dict of the subset spec of each part of SUBSET_PARTS
+    '''
+    specs = dict(specs)
+    for part, spec in specs.items():
+        if isinstance(spec, dict):
+            if part != 'body':
+                raise ValueError('the contacts are only given for the body vertices, not for %s' % part)
+            specs[part] = contact_vertex_ids(sequences, spec['contact'], logger).tolist()
+    return specs
+
+
+def subset_vertex_ids(spec, model):
+    '''
+    the vertex ids of a subset spec
+    :param spec: None for all the vertices, a list of vertex ids, or a region name of REGIONS.
+                 The {'contact': threshold} specs are resolved first with resolve_contact_subsets
+    :param model: the model of the subset, for the named regions
+    :return: a sorted array of vertex ids, or None for all the vertices
+    '''
+    if spec is None:
+        return None
+    if isinstance(spec, str):
+        return region_vertex_ids(model, spec)
+    if isinstance(spec, dict):
+        raise ValueError('resolve the contact subsets with resolve_contact_subsets first')
+    return np.unique(np.asarray(spec, dtype=np.int64))
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2019 Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG),
+# acting on behalf of its Max Planck Institute for Intelligent Systems and the
+# Max Planck Institute for Biological Cybernetics. All rights reserved.
+#
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is holder of all proprietary rights
+# on this computer program. You can only use this computer program if you have closed a license agreement
+# with MPG or you get the right to use the computer program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and liable to prosecution.
+# Contact: ps-license@tuebingen.mpg.de
+#
+
+import os
+import json
+import numpy as np
+import torch
+
+from tools.utils import makepath
+from tools.utils import np2torch
+from tools.quantize import quant_params, encode_array, encoded_shape, encoded_dtype
+
+
+class SplitWriter(object):
+
+    def __init__(self, split_path, fields, codecs=None):
+        ''' Collects the per-sequence outputs of a data split in memory
+            and saves each data group as a .pt file
+
+                Parameters
+                ----------
+                split_path: str
+                    The folder of the data split
+                fields: dict
+                    The field names of each data group, e.g. {'body_data': ['transl', ...]}
+                codecs: dict, optional
+                    The storage codec of the fields to quantize, e.g. {'verts': 'int16', 'contact': 'uint8'}.
+                    The codec parameters and errors are saved in codecs.json
+            '''
+
+        self.split_path = split_path
+        self.fields = fields
+        self.codecs = {} if codecs is None else codecs
+        self.codec_params = {}
+        self.data = {data_name: {k: [] for k in keys} for data_name, keys in fields.items()}
+
+    def write(self, data_name, data, offset):
+        for k, v in data.items():
+            self.data[data_name][k].append(v)
+
+    def encode(self, data_name, k, array, out=None):
+        meta = quant_params(array, self.codecs[k])
+        if callable(out):
+            out = out(meta)
+        array, meta = encode_array(array, meta, out=out)
+        self.codec_params.setdefault(data_name, {})[k] = meta
+        return array
+
+    def save_codecs(self):
+        '''
+        save the codec parameters of the quantized fields
+        :return: dict with the codec parameters of each field, including its largest error (max_error)
+        '''
+        codec_params, self.codec_params = self.codec_params, {}
+        if codec_params:
+            with open(makepath(os.path.join(self.split_path, 'codecs.json'), isfile=True), 'w') as f:
+                json.dump(codec_params, f, indent=1)
+        return codec_params
+
+    def close(self):
+        for data_name, data in self.data.items():
+            data = np2torch(data)
+            for k in data:
+                if k in self.codecs:
+                    data[k] = torch.from_numpy(self.encode(data_name, k, data[k].numpy()))
+            outfname = makepath(os.path.join(self.split_path, '%s.pt' % data_name), isfile=True)
+            torch.save(data, outfname)
+        return self.save_codecs()
+
+
+class MemmapSplitWriter(SplitWriter):
+
+    def __init__(self, split_path, fields, n_frames, save_pt=True, codecs=None):
+        ''' Writes the per-sequence outputs of a data split directly to preallocated
+            memory-mapped .npy files (one per field), so the memory use is bounded by
+            a single sequence. A schema.json describing the .npy files is written on close,
+            so the split can be opened with LoadData(load_mode='memmap').
+
+                Parameters
+                ----------
+                split_path: str
+                    The folder of the data split
+                fields: dict
+                    The field names of each data group, e.g. {'body_data': ['transl', ...]}
+                n_frames: int
+                    The total number of frames of the split
+                save_pt: bool
+                    If True, the .pt files are also written from the memory-mapped arrays
+                codecs: dict, optional
+                    The storage codec of the fields to quantize, the quantized fields
+                    are encoded in chunks on close
+            '''
+
+        super(MemmapSplitWriter, self).__init__(split_path, fields, codecs)
+        self.n_frames = n_frames
+        self.save_pt = save_pt
+        self.data = {data_name: {} for data_name in fields}
+
+    def field_path(self, data_name, k):
+        return os.path.join(self.split_path, data_name, '%s.npy' % k)
+
+    def write(self, data_name, data, offset):
+        for k, v in data.items():
+            arrays = self.data[data_name]
+            if k not in arrays:
+                # the arrays are created on the first write, once the dtype and shape are known
+                outfname = makepath(self.field_path(data_name, k), isfile=True)
+                arrays[k] = np.lib.format.open_memmap(outfname, mode='w+', dtype=v.dtype,
+                                                      shape=(self.n_frames,) + v.shape[1:])
+            arrays[k][offset:offset + v.shape[0]] = v
+
+    def close(self):
+        schema = {'n_frames': int(self.n_frames), 'fields': {}}
+        for data_name, arrays in self.data.items():
+            out = {}
+            schema['fields'][data_name] = {}
+            for k in self.fields[data_name]:
+                if k not in arrays:
+                    continue
+                arrays[k].flush()
+                if k in self.codecs:
+                    arrays[k] = self.encode_memmap(data_name, k)
+                out[k] = torch.from_numpy(arrays[k])
+                schema['fields'][data_name][k] = {'file': '%s/%s.npy' % (data_name, k),
+                                                  'dtype': arrays[k].dtype.str,
+                                                  'shape': list(arrays[k].shape)}
+            if self.save_pt:
+                outfname = makepath(os.path.join(self.split_path, '%s.pt' % data_name), isfile=True)
+                torch.save(out, outfname)
+
+        with open(makepath(os.path.join(self.split_path, 'schema.json'), isfile=True), 'w') as f:
+            json.dump(schema, f, indent=1)
+        self.data = {data_name: {} for data_name in self.fields}
+        return self.save_codecs()
+
+    def encode_memmap(self, data_name, k):
+        # the encoded values are written to a new file, which then replaces the original one.
+        # The writer's memmap of the field is taken out of self.data, so both files are unmapped
+        # before the replace (a mapped file can not be replaced on Windows)
+        field_path = self.field_path(data_name, k)
+        tmp_path = field_path.replace('.npy', '.tmp.npy')
+        array = self.data[data_name].pop(k)
+        n_frames = array.shape[0]
+        out = self.encode(data_name, k, array,
+                          out=lambda meta: np.lib.format.open_memmap(tmp_path, mode='w+',
+                                                                     dtype=encoded_dtype(meta),
+                                                                     shape=(n_frames,) + tuple(encoded_shape(meta))))
+        out.flush()
+        array = out = None
+        os.replace(tmp_path, field_path)
+        return np.load(field_path, mmap_mode='r+')